@@ -1,12 +1,15 @@
 import clr
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 from datetime import datetime
 import math
 import os
 import re
+import subprocess
 import sys
 from typing import Dict, List, Optional
 
+import numpy as np
+
 from connect import *
 from connect.connect_cpython import PyScriptObject
 
@@ -15,7 +18,7 @@ from reportlab.lib.colors import Blacker, Whiter, blue, green, red, yellow
 from reportlab.lib.enums import TA_CENTER, TA_LEFT
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, KeepTogether
+from reportlab.platypus import SimpleDocTemplate, Flowable, Paragraph, Spacer, KeepTogether
 from reportlab.lib.units import inch
 
 clr.AddReference('System.Windows.Forms')
@@ -47,10 +50,22 @@ class PlanChkConstants(object):
     INI_SIM_PLAN_REGEX = r'(initial sim)|(trial_1)'  # An "initial sim" plan name contains this
     CBCT_REGEX = r'CB(CT)?'  # A CBCT setup beam name contains this
 
+    # Compiled versions of regular expressions that are searched frequently
+    PROS_PLAN_RE = re.compile(PROS_PLAN_REGEX)
+    INI_SIM_PLAN_RE = re.compile(INI_SIM_PLAN_REGEX, re.IGNORECASE)
+
     # ---------------------------------------------------------------------------- #
     #                             No changes necessary                             #
     # ---------------------------------------------------------------------------- #
 
+    # Plan types that use VMAT delivery, and plan types that use stereotactic delivery
+    VMAT_TYPES = frozenset(('VMAT', 'SRS', 'SBRT'))
+    SRS_TYPES = frozenset(('SRS', 'SBRT'))
+
+    # Max dose (% Rx) thresholds for each plan type: (warning threshold, error threshold, note to add to the warning or None)
+    # Key None holds the thresholds for all other plan types (IMRT, 3D)
+    MAX_DOSE_THRESHOLDS = {'SRS': (125, 140, None), 'SBRT': (125, 140, None), 'VMAT': (108, 110, 'Ideal is 107&ndash;108%.'), None: (110, 118, None)}
+
     # Paths to Adobe Reader on RS servers
     ADOBE_READER_PATHS = [os.path.join('C:', os.sep, 'Program Files (x86)', 'Adobe', 'Reader 11.0', 'Reader', 'AcroRd32.exe'), os.path.join('C:', os.sep, 'Program Files (x86)', 'Adobe', 'Acrobat Reader DC', 'Reader', 'AcroRd32.exe')]
 
@@ -74,37 +89,82 @@ class PlanChkConstants(object):
     SPCR_SM = Spacer(width, 0.1 * inch)  # Small
     SPCR_LG = Spacer(width, 0.3 * inch)  # Large
 
+    # Dimension names, in order, for converting RayStation coordinate dictionaries to arrays
+    DIMS = ('x', 'y', 'z')
+
     # HTML bulleted list formatting for ReportLab Paragraph text
     NEWLINE_AND_BULLET = '<br/>' + '&nbsp;' * 4 + '&bull;' + '&nbsp;' * 2
+    BULLET_JOIN = NEWLINE_AND_BULLET.join  # Bound once so message formatting doesn't look up the separator each time
+
+    @staticmethod
+    def bullet_msg(header: str, items: List[str]) -> str:
+        """Formats a message as a header followed by a bulleted list of items
+
+        Arguments
+        ---------
+        header: The text before the bulleted list
+        items: The bulleted list items
+
+        Returns
+        -------
+        The ReportLab Paragraph text
+
+        Example
+        -------
+        PlanChkConstants.bullet_msg('Couch ROIs exist:', ['Elekta Couch', 'Elekta Couch Inner']) -> 'Couch ROIs exist:<br/>&nbsp;&nbsp;&nbsp;&nbsp;&bull;&nbsp;&nbsp;Elekta Couch<br/>...'
+        """
+        return PlanChkConstants.BULLET_JOIN((header, *items))
 
 
-def distance(a: Dict[str, float], b: Optional[Dict[str, float]] = {'x': 0, 'y': 0, 'z': 0}) -> float:
-    """Computes the Euclidean distance between two points a and b in 3D space
+# Attributes of an ROI geometry that are needed by several checks
+# Reading these once per geometry avoids re-enumerating the RayStation collection for each check
+GeomInfo = namedtuple('GeomInfo', ['name', 'has_contours', 'type', 'material', 'derived', 'geom'])
+
+
+def any_coord_gt(a: Dict[str, float], b: Dict[str, float]) -> bool:
+    """Determines whether any coordinate of point a is greater than the corresponding coordinate of point b
 
     Arguments
     ---------
     a: Coordinates of the first point
-       A dictionary with dimensions as keys and coordinates as values
-    b: Coordinates of the second point.
-       A dictionary with dimensions as keys and coordinates as values
-       Defaults to the origin
-       `a` and `b` must have the same keys
+       A dictionary with dimensions 'x', 'y', and 'z' as keys, and coordinates as values
+    b: Coordinates of the second point
+       A dictionary with dimensions 'x', 'y', and 'z' as keys, and coordinates as values
 
     Returns
     -------
-    The distance between the two points
+    True if any coordinate of `a` is greater than that of `b`, False otherwise
 
-    Examples
-    --------
-    distance({'x': 2, 'y': 3, 'z': -4}, {'x': 0, 'y': 1, 'z': 1}) -> 5.74...
-    distance({'x': 2, 'y': 3, 'z': -4}) -> 5.38...
+    Example
+    -------
+    any_coord_gt({'x': 0, 'y': 2, 'z': 0}, {'x': 1, 'y': 1, 'z': 1}) -> True
     """
+    return a['x'] > b['x'] or a['y'] > b['y'] or a['z'] > b['z']
+
+
+def any_coord_lt(a: Dict[str, float], b: Dict[str, float]) -> bool:
+    """Determines whether any coordinate of point a is less than the corresponding coordinate of point b
+
+    Arguments
+    ---------
+    a: Coordinates of the first point
+       A dictionary with dimensions 'x', 'y', and 'z' as keys, and coordinates as values
+    b: Coordinates of the second point
+       A dictionary with dimensions 'x', 'y', and 'z' as keys, and coordinates as values
 
-    return math.sqrt(sum((val - b[coord]) ** 2 for coord, val in a.items()))
+    Returns
+    -------
+    True if any coordinate of `a` is less than that of `b`, False otherwise
+
+    Example
+    -------
+    any_coord_lt({'x': 2, 'y': 0, 'z': 2}, {'x': 1, 'y': 1, 'z': 1}) -> True
+    """
+    return a['x'] < b['x'] or a['y'] < b['y'] or a['z'] < b['z']
 
 
-def get_contour_coords(case: PyScriptObject, exam: PyScriptObject, geom: PyScriptObject) -> List[Dict[str, float]]:
-    """Gets a list of the contour coordinates of an ROI geometry
+def get_contour_coords(case: PyScriptObject, exam: PyScriptObject, geom: PyScriptObject) -> np.ndarray:
+    """Gets the contour coordinates of an ROI geometry
 
     Arguments
     ---------
@@ -114,32 +174,32 @@ def get_contour_coords(case: PyScriptObject, exam: PyScriptObject, geom: PyScrip
 
     Returns
     -------
-    A list of the 3D points that comprise the geometry
-    Each point is a dictionary with dimensions as keys and coordinates as values
-    If the geometry is empty, returns an empty list
+    A C-contiguous (N, 3) array of the 3D points that comprise the geometry
+    Columns are x, y, and z coordinates
+    If the geometry is empty, returns an empty (0, 3) array
 
     Example
     -------
-    get_contour_coords(some_case, some_exam, some_geom) -> {'x': 0, 'y': 1, 'z': 2}, ...]
+    get_contour_coords(some_case, some_exam, some_geom) -> array([[0., 1., 2.], ...])
     """
 
     if not geom.HasContours():  # Empty geometry
-        return []
+        return np.empty((0, 3), dtype=np.float64)
     
     # If has contour representation, just flatten contour coords array and return
     # Otherwise, copy ROI, set copy's representation to contours, delete the copy, and return the copy's flattened contours array
     if hasattr(geom.PrimaryShape, 'Contours'):  # Contour representation
-        coords = [c for coord in geom.PrimaryShape.Contours for c in coord]  # Flatten contours array
+        coords = [[c[dim] for dim in PlanChkConstants.DIMS] for contour in geom.PrimaryShape.Contours for c in contour]  # Flatten contours array
     else:
         copy_name = case.PatientModel.GetUniqueRoiName(DesiredName=geom.OfRoi.Name)
         copy = case.PatientModel.CreateRoi(Name=copy_name, Color=geom.OfRoi.Color, Type=geom.OfRoi.Type)  # Create ROI w/ same color and type as geom's ROI
         copy.CreateAlgebraGeometry(Examination=exam, ExpressionA={ 'Operation': 'Union', 'SourceRoiNames': [geom.OfRoi.Name], 'MarginSettings': { 'Type': 'Expand', 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 } }, ExpressionB={ 'Operation': 'Union', 'SourceRoiNames': [], 'MarginSettings': { 'Type': 'Expand', 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 } }, ResultOperation='None', ResultMarginSettings={ 'Type': 'Expand', 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0})  # Copy has same geometry
         copy_geom = case.PatientModel.StructureSets[exam.Name].RoiGeometries[copy_name]
-        copy_eom.SetRepresentation(Representation='Contours')  # Convert to contour representation
-        coords = [c for coord in geom.PrimaryShape.Contours for c in coord]  # Flatten contours array
+        copy_geom.SetRepresentation(Representation='Contours')  # Convert to contour representation
+        coords = [[c[dim] for dim in PlanChkConstants.DIMS] for contour in copy_geom.PrimaryShape.Contours for c in contour]  # Flatten contours array
         copy.DeleteRoi()  # We no longer need the copy
     
-    return coords
+    return np.ascontiguousarray(coords, dtype=np.float64).reshape(-1, 3)  # (N, 3) array
 
 
 def goal_str(goal: PyScriptObject) -> str:
@@ -196,6 +256,35 @@ def goal_str(goal: PyScriptObject) -> str:
     return goal_txt
 
 
+def contains_word(text: str, word: str) -> bool:
+    """Determines whether a word appears in a string, bounded on each side by a non-letter or the end of the string
+
+    Case insensitive. Uses plain substring search instead of a regular expression
+
+    Arguments
+    ---------
+    text: The string to search
+    word: The lowercase word to search for
+
+    Returns
+    -------
+    True if the word is found, False otherwise
+
+    Examples
+    --------
+    contains_word('R Lung SBRT', 'lung') -> True
+    contains_word('Lungs', 'lung') -> False
+    """
+    text = text.lower()
+    idx = text.find(word)
+    while idx != -1:
+        end = idx + len(word)
+        if (idx == 0 or not 'a' <= text[idx - 1] <= 'z') and (end == len(text) or not 'a' <= text[end] <= 'z'):
+            return True
+        idx = text.find(word, idx + 1)
+    return False
+
+
 def format_coords(point: Dict[str, float]) -> str:
     """Formats IEC 61217 patient coordinates to DICOM patient coordinates and nicely formats for display
 
@@ -273,16 +362,35 @@ def format_num(num: float) -> str:
     return str(round(num, 2)).rstrip('0').rstrip('.')  # For number that doesn't need scientific formatting, round to 2 decimal places, remove trailing zeroes, and remove trailing decimal point
 
 
-def will_gantry_collide(cyl: PyScriptObject, struct_set: PyScriptObject, r: float, iso: Dict[str, float], likelihood: str, couch_bounds: Optional[List[Dict[str, float]]] = None, ext_bounds: Optional[List[Dict[str, float]]] = None) -> Optional[str]:
+def round_half_up(num: float) -> int:
+    """Rounds a nonnegative number to the nearest integer, with halves rounded up
+
+    A single floor operation instead of the `int(round(...))` round trip
+
+    Argument
+    --------
+    num: The number to round
+
+    Returns
+    -------
+    The rounded integer
+
+    Examples
+    --------
+    round_half_up(2.5) -> 3
+    round_half_up(2.49) -> 2
+    """
+    return math.floor(num + 0.5)
+
+
+def will_gantry_collide(r: float, iso: Dict[str, float], likelihood: str, couch_bounds: Optional[List[Dict[str, float]]] = None, ext_bounds: Optional[List[Dict[str, float]]] = None) -> Optional[str]:
     """Determines whether the couch and/or external geometries will likely collide with the gantry, using radius `r`
 
     A collision of a geometry with the gantry is likely if the geometry is more than `r` cm from the central z-axis through the iso, in any direction. 
-    15 cm above and below (on the z-axis) the iso are checked
+    The cylinder is not created as an ROI. Its bounds in x and y are computed directly from the iso and radius
 
     Arguments
     ---------
-    cyl: The ROI to use for the cylinder geometry
-    struct_set: The structure set that the geometry belongs to
     r: The cylinder radius to use
     iso: The coordinates of the isocenter. The center of the cylinder geometry to create
     likelihood: String describing the "likelihood" if gantry collision. E.g., "likely", "very likely"
@@ -296,17 +404,17 @@ def will_gantry_collide(cyl: PyScriptObject, struct_set: PyScriptObject, r: floa
     A message dsecrbing the likelihood of collision with couch and/or external (patient)
     Returns None if collision is unlikely
     """
-    # Create cylinder geometry
-    cyl.CreateCylinderGeometry(Radius=r, Axis={'x': 0, 'y': 0, 'z': 1}, Length=30, Examination=struct_set.OnExamination, Center=iso)  # Cylinder w/ 30 cm height in inf-sup direction, centered at the iso
-    cyl_bounds = struct_set.RoiGeometries[cyl.Name].GetBoundingBox()  # Cylinder bounding box
+    # Bounds of a cylinder in the inf-sup direction, centered at the iso
+    cyl_min_x, cyl_min_y = iso['x'] - r, iso['y'] - r
+    cyl_max_x, cyl_max_y = iso['x'] + r, iso['y'] + r
     
     # Do couch and/or external geometries extend outside the cylinder?
     if couch_bounds is not None:
-        couch_collide = couch_bounds[0].x <= cyl_bounds[0].x or couch_bounds[0].y <= cyl_bounds[0].y or couch_bounds[1].x >= cyl_bounds[1].x or couch_bounds[1].y >= cyl_bounds[1].y
+        couch_collide = couch_bounds[0].x <= cyl_min_x or couch_bounds[0].y <= cyl_min_y or couch_bounds[1].x >= cyl_max_x or couch_bounds[1].y >= cyl_max_y
     else:
         couch_collide = False
     if ext_bounds is not None:
-        ext_collide = ext_bounds[0].x <= cyl_bounds[0].x or ext_bounds[0].y <= cyl_bounds[0].y or ext_bounds[1].x >= cyl_bounds[1].x or ext_bounds[1].y >= cyl_bounds[1].y
+        ext_collide = ext_bounds[0].x <= cyl_min_x or ext_bounds[0].y <= cyl_min_y or ext_bounds[1].x >= cyl_max_x or ext_bounds[1].y >= cyl_max_y
     else:
         ext_collide = False
 
@@ -319,6 +427,97 @@ def will_gantry_collide(cyl: PyScriptObject, struct_set: PyScriptObject, r: floa
         return f'The patient is >{r} cm away from the gantry. Collision may be {likelihood}.'  # Likely to collide with external but not couch   
 
 
+def is_inf_point(point: Dict[str, float]) -> bool:
+    """Determines whether any coordinate of a point is infinite
+
+    RayStation uses infinite coordinates for undefined POI geometries
+
+    Argument
+    --------
+    point: The coordinates to check
+           A dictionary with dimensions 'x', 'y', and 'z' as keys, and coordinates as values
+
+    Returns
+    -------
+    True if any coordinate is positive or negative infinity, False otherwise
+    """
+    return math.isinf(point['x']) or math.isinf(point['y']) or math.isinf(point['z'])
+
+
+def is_outside_box(point: Dict[str, float], box_min: Dict[str, float], box_max: Dict[str, float]) -> bool:
+    """Determines whether a point lies outside an axis-aligned box
+
+    Coordinates are compared one at a time, returning as soon as one is outside the box
+
+    Arguments
+    ---------
+    point: The coordinates to check
+           A dictionary with dimensions 'x', 'y', and 'z' as keys, and coordinates as values
+    box_min: The minimum coordinates of the box
+    box_max: The maximum coordinates of the box
+
+    Returns
+    -------
+    True if the point is outside the box, False otherwise
+
+    Example
+    -------
+    is_outside_box({'x': 0, 'y': 5, 'z': 0}, {'x': -1, 'y': -1, 'z': -1}, {'x': 1, 'y': 1, 'z': 1}) -> True
+    """
+    return point['x'] < box_min['x'] or point['y'] < box_min['y'] or point['z'] < box_min['z'] or point['x'] > box_max['x'] or point['y'] > box_max['y'] or point['z'] > box_max['z']
+
+
+def min_distance(a: np.ndarray, b: np.ndarray) -> float:
+    """Computes the smallest Euclidean distance between any point in a and any point in b
+
+    Distances are computed with NumPy broadcasting, a block of rows of `a` at a time so that the intermediate distance matrix stays small
+
+    Arguments
+    ---------
+    a: The first set of points, as an (N, 3) array
+    b: The second set of points, as an (M, 3) array
+
+    Returns
+    -------
+    The minimum distance
+    If either set of points is empty, returns infinity
+
+    Example
+    -------
+    min_distance(np.array([[0, 0, 0], [5, 5, 5]]), np.array([[1, 0, 0], [9, 9, 9]])) -> 1.0
+    """
+    if a.shape[0] == 0 or b.shape[0] == 0:
+        return float('Inf')
+
+    block_sz = max(1, 1000000 // b.shape[0])  # Number of rows of `a` per block, so that each block's distance matrix has at most ~1 million elements
+    min_sq_dist = float('Inf')
+    for start in range(0, a.shape[0], block_sz):
+        diffs = a[start:start + block_sz, np.newaxis, :] - b[np.newaxis, :, :]  # (block size, M, 3)
+        min_sq_dist = min(min_sq_dist, float(np.einsum('ijk,ijk->ij', diffs, diffs).min()))
+    return math.sqrt(min_sq_dist)
+
+
+def add_section(elems: List[Flowable], heading: str, heading_style: ParagraphStyle, msgs: List[str], msg_style: ParagraphStyle) -> None:
+    """Appends a heading and its messages to a list of ReportLab flowables
+
+    Each Paragraph is wrapped in a KeepTogether so that it is not split across pages
+    A small spacer follows the heading, and a large spacer follows each message
+
+    Arguments
+    ---------
+    elems: The flowables to append to
+    heading: The section heading text
+    heading_style: The style for the heading Paragraph
+    msgs: The message texts
+    msg_style: The style for each message Paragraph
+    """
+    elems.append(KeepTogether(Paragraph(heading, style=heading_style)))
+    elems.append(PlanChkConstants.SPCR_SM)
+    for msg in msgs:
+        elems.append(KeepTogether(Paragraph(msg, style=msg_style)))
+        elems.append(PlanChkConstants.SPCR_LG)
+
+
 def plan_check() -> None:
     """Performs an "Initial Physics Review" plan check on the current plan
 
@@ -430,7 +629,8 @@ def plan_check() -> None:
     # OrderedDict to retain original order of beam sets, since this dict is used later to iterate over beam sets
     # Dict elements are beam set : plan type ('SRS', 'SBRT', 'VMAT', 'IMRT', or '3D')
     plan_types = OrderedDict()  
-    for beam_set in plan.BeamSets:
+    beam_sets = list(plan.BeamSets)
+    for beam_set in beam_sets:
         if beam_set.Modality == 'Photons':  # Ignore beam sets that are not photons
             fx = beam_set.FractionationPattern
             if fx is not None:
@@ -473,16 +673,21 @@ def plan_check() -> None:
     filepath = os.path.join(PlanChkConstants.OUTPUT_DIR, re.sub(r'[<>:"/\\\|\?\*]', '_', filename))
     pdf = SimpleDocTemplate(filepath, pagesize=letter, bottomMargin=0.2 * inch, leftMargin=0.25 * inch, rightMargin=0.2 * inch, topMargin=0.2 * inch)  # 8.5 x 11" w/ 0.25" left & right margins, & 0.2" top & bottom margins
 
+    # Styles used throughout the report, bound to locals once
+    styles = PlanChkConstants.STYLES
+    hdg3_style, hdg4_style = styles['Heading3'], styles['Heading4']
+    fail_style, warn_style, pass_style, manual_style = (styles[lvl] for lvl in (PlanChkConstants.FAIL, PlanChkConstants.WARN, PlanChkConstants.PASS, PlanChkConstants.MANUAL))
+
     # Headings
-    hdg = Paragraph(pt_name, style=PlanChkConstants.STYLES['Heading1'])  # e.g., 'Jones, Bill'
-    mrn = Paragraph('MRN: ' + patient.PatientID, style=PlanChkConstants.STYLES['Heading2'])  # e.g., 'MRN: 000123456'
-    plan_chk = Paragraph('Plan Check: ' + plan.Name, style=PlanChkConstants.STYLES['Heading2'])  # e.g., 'Plan Check: Prostate'
-    elems = [hdg, mrn, plan_chk]
+    hdg = Paragraph(pt_name, style=styles['Heading1'])  # e.g., 'Jones, Bill'
+    mrn = Paragraph('MRN: ' + patient.PatientID, style=styles['Heading2'])  # e.g., 'MRN: 000123456'
+    plan_chk = Paragraph('Plan Check: ' + plan.Name, style=styles['Heading2'])  # e.g., 'Plan Check: Prostate'
+    elems = [KeepTogether(hdg), KeepTogether(mrn), KeepTogether(plan_chk)]  # Each Paragraph is wrapped in KeepTogether as it is added, so the list doesn't need a second pass before the build
 
     is_vmat_hn = set(plan_types.values()) == {'VMAT'} and case.BodySite == 'Head and Neck'  # Only VMAT H&N plans may lack couch
 
     rois = case.PatientModel.RegionsOfInterest
-    roi_names = [roi.Name for roi in rois]
+    roi_names = frozenset(roi.Name for roi in rois)  # Set for fast membership tests
     
     # Lists of messages
     fail_msgs = []  # Errors
@@ -530,16 +735,17 @@ def plan_check() -> None:
     try:
         ext = next(roi for roi in rois if roi.Type == 'External')  # There will never be more than one external ROI
     except StopIteration:
-        ext = None
+        ext = ext_name = None
         msg = 'There is no external ROI.'
         fail_msgs.append(msg)
     else:
+        ext_name = ext.Name  # Read once; used by many checks below
         msg = 'External ROI exists.'
         pass_msgs_section.append(msg)
 
         # External is named "External"
-        if ext.Name != 'External':
-            msg = 'External ROI is named "' + ext.Name + '", not "External".'
+        if ext_name != 'External':
+            msg = 'External ROI is named "' + ext_name + '", not "External".'
             fail_msgs.append(msg)
         else:
             msg = 'External ROI is named "External".'
@@ -559,11 +765,11 @@ def plan_check() -> None:
     case_attrs = {'Body site': case.BodySite, 'Diagnosis': case.Diagnosis, 'Physician name': case.Physician.Name}
     attrs = [attr for attr, case_attr in sorted(case_attrs.items()) if case_attr == '']
     if attrs:
-        msg = 'Case information is missing:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(attrs)
+        msg = PlanChkConstants.bullet_msg('Case information is missing:', attrs)
         warn_msgs.append(msg)
     else:
         case_attrs = [attr + ': ' + case_attr for attr, case_attr in sorted(case_attrs.items())]  # e.g., 'Body site: Thorax'
-        msg = 'All case information is filled in:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(case_attrs)
+        msg = PlanChkConstants.bullet_msg('All case information is filled in:', case_attrs)
         pass_msgs_section.append(msg)
 
     # MD name includes "MD" suffix
@@ -579,7 +785,7 @@ def plan_check() -> None:
     # Exams: Imaging system name is HOST-7307
     wrong_img_sys = [e.Name for e in case.Examinations if e.EquipmentInfo.ImagingSystemReference is None or e.EquipmentInfo.ImagingSystemReference.ImagingSystemName != 'HOST-7307']
     if wrong_img_sys:
-        msg = 'The imaging system is incorrect for the following exams:<br/>&nbsp;&nbsp;&nbsp;&nbsp;&bull;&nbsp;&nbsp;{}'.format('<br/>&nbsp;&nbsp;&nbsp;&nbsp;&bull;&nbsp;&nbsp;'.join(wrong_img_sys))
+        msg = PlanChkConstants.bullet_msg('The imaging system is incorrect for the following exams:', wrong_img_sys)
         fail_msgs.append(msg)
     else:
         msg = 'All exams have imaging system HOST-7307.'
@@ -588,7 +794,7 @@ def plan_check() -> None:
     # Exam names include date
     missing_date = [e.Name for e in case.Examinations if re.search(fr'({PlanChkConstants.DATE_REGEX})|(^{PlanChkConstants.IMG_FOR_TEMPLATES_REGEX}$)', e.Name, re.IGNORECASE) is None]  # Very crude date regex: does not validate month, day, or year numbers. Also, ignore "IMAGE FOR TEMPLATES" exams
     if missing_date:
-        msg = 'The following exam names are missing a date:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(missing_date)
+        msg = PlanChkConstants.bullet_msg('The following exam names are missing a date:', missing_date)
         warn_msgs.append(msg)
     else:
         msg = 'All exam names include a date.'
@@ -598,20 +804,25 @@ def plan_check() -> None:
     missing_couch_rois = [couch_name for couch_name in couch_names if couch_name not in roi_names]
     if not is_vmat_hn:
         if missing_couch_rois:
-            msg = 'Couch ROI(s) are missing:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(missing_couch_rois)
+            msg = PlanChkConstants.bullet_msg('Couch ROI(s) are missing:', missing_couch_rois)
             if set(plan_types.values()) == {'3D'}:  # All plans are 3D
                 warn_msgs.append(msg)
             else:  # There are IMRT plans
                 fail_msgs.append(msg)
         else:
-            msg = 'Couch ROIs exist:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(couch_names)
+            msg = PlanChkConstants.bullet_msg('Couch ROIs exist:', couch_names)
             pass_msgs_section.append(msg)
 
     # "Initial sim" plan exists
-    try:
-        ini_sim_plan = next(p for p in case.TreatmentPlans if re.match(PlanChkConstants.INI_SIM_PLAN_REGEX, p.Name, re.IGNORECASE) is not None and ('SBRT' in plan_types.values() or p.GetTotalDoseStructureSet().OnExamination.Equals(exam)))  # "Initial sim" plan must be on planning exam unless this is an SBRT plan
-    except StopIteration:
-        ini_sim_plan = None
+    # "Initial sim" plan must be on planning exam unless this is an SBRT plan
+    # Check the cheap name and SBRT predicates first so that the structure set is only retrieved when necessary
+    is_sbrt = 'SBRT' in plan_types.values()
+    ini_sim_plan = None
+    for p in case.TreatmentPlans:
+        if PlanChkConstants.INI_SIM_PLAN_RE.match(p.Name) is not None and (is_sbrt or p.GetTotalDoseStructureSet().OnExamination.Equals(exam)):
+            ini_sim_plan = p
+            break
+    if ini_sim_plan is None:
         msg = 'There is no "Initial Sim" plan.'
         warn_msgs.append(msg)
     else:
@@ -627,6 +838,32 @@ def plan_check() -> None:
 
     dose_dist = plan.TreatmentCourse.TotalDose
 
+    # Information about each geometry on the planning exam
+    # Each attribute access is a round trip to RayStation, so make a single pass over the geometries, reading each attribute once and sorting each geometry into the lists used by the checks below
+    roi_geoms = {}  # ROI name : geometry. Faster than indexing `struct_set.RoiGeometries`
+    has_contours = {}  # ROI name : whether the geometry has contours
+    empty_geom_names = []  # Empty geometries other than the external. No external should be error (checked below), not warning
+    dg_rois = {}  # ROI name : dose grid ROI, for nonempty geometries
+    stray_candidates = []  # Nonempty geometries that should be inside the external. Ignore the external contour, any other external contours, FOV or support (e.g., couch) contours, and ROIs with a material defined
+    boli = []  # Non-derived nonempty bolus geometries
+    dg_candidates = []  # Nonempty geometries that should be inside the dose grid. Ignore FOV, and bolus/fixation/support with material override
+    for geom in struct_set.RoiGeometries:
+        geom_roi = geom.OfRoi
+        info = GeomInfo(geom_roi.Name, geom.HasContours(), geom_roi.Type, geom_roi.RoiMaterial, geom_roi.DerivedRoiExpression, geom)
+        roi_geoms[info.name] = geom
+        has_contours[info.name] = info.has_contours
+        if not info.has_contours:
+            if info.name != ext_name:
+                empty_geom_names.append(info.name)
+            continue
+        dg_rois[info.name] = dose_dist.GetDoseGridRoi(RoiName=info.name)
+        if info.type not in ['Bolus', 'Control', 'External', 'FieldOfView', 'Fixation', 'Support'] and info.material is None:
+            stray_candidates.append(info)
+        if info.type == 'Bolus' and info.derived is None:
+            boli.append(info)
+        if info.type != 'FieldOfView' and not (info.type in ['Bolus', 'Fixation', 'Support'] and info.material is not None):
+            dg_candidates.append(info)
+
     # Plan information is filled in
     if plan.PlannedBy == '':
         msg = 'Planner is not specified.'
@@ -637,7 +874,7 @@ def plan_check() -> None:
 
     if ext is not None:
         # External has geometry on planning exam
-        if not struct_set.RoiGeometries[ext.Name].HasContours():
+        if not has_contours[ext_name]:
             msg = 'There is no external geometry on the planning exam.'
             fail_msgs.append(msg)
         else:
@@ -646,28 +883,28 @@ def plan_check() -> None:
 
     # For prostate plans, ensure certain ROIs exist
     # We know it's a prostate plan if any of certain prostate-related keywords is in certain case/plan/beam set info fields
-    chk_for_body_site = [case.BodySite, case.CaseName, case.Comments, case.Diagnosis, plan.Comments, plan.Name] + [beam_set.DicomPlanLabel for beam_set in plan.BeamSets]  # Fields to check for prostate keywords
-    if any(re.search(PlanChkConstants.PROS_PLAN_REGEX, attr) is not None for attr in chk_for_body_site):  # It's a prostate plan
+    chk_for_body_site = [case.BodySite, case.CaseName, case.Comments, case.Diagnosis, plan.Comments, plan.Name] + [beam_set.DicomPlanLabel for beam_set in beam_sets]  # Fields to check for prostate keywords
+    # Search all fields at once. Null separator is a non-letter, so it acts as a keyword boundary without letting keywords span fields
+    if PlanChkConstants.PROS_PLAN_RE.search('\x00'.join(attr or '' for attr in chk_for_body_site)) is not None:  # It's a prostate plan
         pros_rois = ['Bladder', 'Rectum', 'Colon_Sigmoid', 'Bag_Bowel']  # ROIs that must be present if this is a prostate plan
         missing_pros_rois = [pros_roi for pros_roi in pros_rois if pros_roi not in roi_names]
         if missing_pros_rois:
-            msg = 'Important prostate plan ROI(s) are missing:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(missing_pros_rois)
+            msg = PlanChkConstants.bullet_msg('Important prostate plan ROI(s) are missing:', missing_pros_rois)
             fail_msgs.append(msg)
         else:
-            msg = 'Important prostate plan ROIs exist:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(pros_rois)
+            msg = PlanChkConstants.bullet_msg('Important prostate plan ROIs exist:', pros_rois)
             pass_msgs_section.append(msg)
 
     # Empty geometries on planning exam
-    empty_geom_names = [geom.OfRoi.Name for geom in struct_set.RoiGeometries if not geom.HasContours() and not geom.OfRoi.Equals(ext)]  # No external should be error (taken care of above), not warning
     if empty_geom_names:
-        msg = 'The following ROIs are empty on the planning exam:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(empty_geom_names)
+        msg = PlanChkConstants.bullet_msg('The following ROIs are empty on the planning exam:', empty_geom_names)
         warn_msgs.append(msg)
     else:
         msg = 'There are no empty geometries on the planning exam.'
         pass_msgs_section.append(msg)
 
     # ROIs that have been updated since last voxel volume computation: have contours but no volume in dose grid
-    dose_stats_missing = [geom.OfRoi.Name for geom in struct_set.RoiGeometries if geom.OfRoi.Name not in couch_names and geom.HasContours() and dose_dist.GetDoseGridRoi(RoiName=geom.OfRoi.Name).RoiVolumeDistribution is None]
+    dose_stats_missing = [roi_name for roi_name, dg_roi in dg_rois.items() if roi_name not in couch_names and dg_roi.RoiVolumeDistribution is None]
     if dose_stats_missing:
         msg = 'Dose statistics need updating.'
         warn_msgs.append(msg)
@@ -684,11 +921,11 @@ def plan_check() -> None:
     exam_px_sz = img_stack.PixelSize
     
     # Dose grid contained inside planning exam, ideally with some "padding" between them
-    if all(couch_name in missing_couch_rois or not struct_set.RoiGeometries[couch_name].HasContours() for couch_name in couch_names):
-        if any(dg_min[dim] < coord for dim, coord in exam_min.items()) or any(dg_max[dim] > coord for dim, coord in exam_max.items()):
+    if all(couch_name in missing_couch_rois or not has_contours[couch_name] for couch_name in couch_names):
+        if any_coord_lt(dg_min, exam_min) or any_coord_gt(dg_max, exam_max):
             msg = 'Dose grid extends outside planning exam.'
             warn_msgs.append(msg)
-        elif any(dg_min[dim] - exam_min[dim] < sz for dim, sz in exam_px_sz.items()) or dg_min['z'] - exam_min['z'] < dg.VoxelSize.z or any(exam_max[dim] - dg_max[dim] < sz for dim, sz in exam_px_sz.items()) or exam_min['z'] - dg_min['z'] < dg.VoxelSize.z:
+        elif dg_min['x'] - exam_min['x'] < exam_px_sz['x'] or dg_min['y'] - exam_min['y'] < exam_px_sz['y'] or dg_min['z'] - exam_min['z'] < dg.VoxelSize.z or exam_max['x'] - dg_max['x'] < exam_px_sz['x'] or exam_max['y'] - dg_max['y'] < exam_px_sz['y'] or exam_min['z'] - dg_min['z'] < dg.VoxelSize.z:  # Image pixel size is in x and y only
             msg = 'There should be at least 1 px between each dose grid and planning exam edge.'
             warn_msgs.append(msg)
         else:
@@ -699,8 +936,8 @@ def plan_check() -> None:
     # A contour extends outside external if any of its min coords are less than external min coordinates, or any of its max coordinates are greater than external max coordinates
     # Ignore coordinates outside the planning exam or dose grid, whichever is stricter
     if ext is not None and dose_dist.DoseValues is not None and len(set(dg.VoxelSize.values())) == 1:  # External exists, dose grid is defined, and dose grid voxel sizes are uniform
-        ext_geom = struct_set.RoiGeometries[ext.Name]
-        if ext_geom.HasContours():
+        ext_geom = roi_geoms[ext_name]
+        if has_contours[ext_name]:
             vox_sz = dg.VoxelSize.x 
 
             # Min and max coordinates in dose grid, defined by a box geometry
@@ -715,34 +952,37 @@ def plan_check() -> None:
             # Voxel indices of planning exam, and external w/ 3 mm margin
             ext_prv_name = case.PatientModel.GetUniqueRoiName(DesiredName=f'External_PRV{str(int(vox_sz * 10)).zfill(2)}')
             ext_prv = case.PatientModel.CreateRoi(Name=ext_prv_name, Type='Control')
-            ext_prv.SetMarginExpression(SourceRoiName=ext.Name, MarginSettings={ 'Type': 'Expand', 'Superior': vox_sz, 'Inferior': vox_sz, 'Anterior': vox_sz, 'Posterior': vox_sz, 'Right': vox_sz, 'Left': vox_sz })
+            ext_prv.SetMarginExpression(SourceRoiName=ext_name, MarginSettings={ 'Type': 'Expand', 'Superior': vox_sz, 'Inferior': vox_sz, 'Anterior': vox_sz, 'Posterior': vox_sz, 'Right': vox_sz, 'Left': vox_sz })
             ext_prv.UpdateDerivedGeometry(Examination=exam)
             dose_dist.UpdateDoseGridStructures()
-            box_vi = set(dose_dist.GetDoseGridRoi(RoiName=box_name).RoiVolumeDistribution.VoxelIndices)  # Voxel indices of box geometry ("voxel indices" of image)
-            ext_vi = set(dose_dist.GetDoseGridRoi(RoiName=ext_prv_name).RoiVolumeDistribution.VoxelIndices).intersection(box_vi)  # Voxel indices of external ROI that are inside the image / dose grid
+            # Get the dose grid ROIs whose statistics were missing again, since the proxies from before the update may not reflect it
+            for roi_name in set(dose_stats_missing + [ext_name]):
+                dg_rois[roi_name] = dose_dist.GetDoseGridRoi(RoiName=roi_name)
+            # Voxel indices are kept as int32 arrays instead of sets of Python ints, which are much larger and slower to intersect
+            box_vi = np.fromiter(dose_dist.GetDoseGridRoi(RoiName=box_name).RoiVolumeDistribution.VoxelIndices, dtype=np.int32)  # Voxel indices of box geometry ("voxel indices" of image)
+            ext_vi = np.intersect1d(np.fromiter(dose_dist.GetDoseGridRoi(RoiName=ext_prv_name).RoiVolumeDistribution.VoxelIndices, dtype=np.int32), box_vi, assume_unique=True)  # Voxel indices of external ROI that are inside the image / dose grid
 
             # Delete unnecessary ROIs
             box.DeleteRoi()  # Box ROI no longer needed
             ext_prv.DeleteRoi()
 
             stray_contours = []  # Geometries that extend outside external
-            for geom in struct_set.RoiGeometries:
-                if geom.HasContours() and geom.OfRoi.Type not in ['Bolus', 'Control', 'External', 'FieldOfView', 'Fixation', 'Support'] and geom.OfRoi.RoiMaterial is None:  # Ignore the external contour, any other external contours, FOV or support (e.g., couch) contours, and ROIs with a material defined
-                    geom_vi = set(dose_dist.GetDoseGridRoi(RoiName=geom.OfRoi.Name).RoiVolumeDistribution.VoxelIndices).intersection(box_vi)  # Voxel indices of the geometry that are inside the image
-                    if not geom_vi.issubset(ext_vi):
-                        stray_contours.append(geom.OfRoi.Name)
+            for info in stray_candidates:
+                geom_vi = np.intersect1d(np.fromiter(dg_rois[info.name].RoiVolumeDistribution.VoxelIndices, dtype=np.int32), box_vi, assume_unique=True)  # Voxel indices of the geometry that are inside the image
+                if not np.isin(geom_vi, ext_vi, assume_unique=True).all():  # Geometry is not a subset of the external
+                    stray_contours.append(info.name)
             
             if stray_contours:
-                msg = 'The following contours extend outside the external:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(stray_contours)
+                msg = PlanChkConstants.bullet_msg('The following contours extend outside the external:', stray_contours)
                 fail_msgs.append(msg)
             else:
                 msg = 'All contours are contained inside the external.'
                 pass_msgs_section.append(msg)
 
         # External extends to couch w/o gap or overlap
-        if 'SBRT' in plan_types.values() and not missing_couch_rois and struct_set.RoiGeometries[outer_couch_name].HasContours() and struct_set.RoiGeometries[inner_couch_name].HasContours():
-            ext_bottom = struct_set.RoiGeometries[ext.Name].GetBoundingBox()[1].y  # Bottom of external
-            couch_top = struct_set.RoiGeometries[outer_couch_name].GetBoundingBox()[0].y
+        if 'SBRT' in plan_types.values() and not missing_couch_rois and has_contours[outer_couch_name] and has_contours[inner_couch_name]:
+            ext_bottom = ext_geom.GetBoundingBox()[1].y  # Bottom of external
+            couch_top = roi_geoms[outer_couch_name].GetBoundingBox()[0].y
             diff = round(ext_bottom - couch_top, 2)
             if diff < -0.3:
                 msg = f'External and couch overlap by {-diff} cm.'
@@ -755,39 +995,35 @@ def plan_check() -> None:
                 pass_msgs_section.append(msg)
 
     # No gap between adjacent boli
-    boli = [geom for geom in struct_set.RoiGeometries if geom.HasContours() and geom.OfRoi.Type == 'Bolus' and geom.OfRoi.DerivedRoiExpression is None]  # Non-derived bolus geometries
     if len(boli) > 1:  # Plan has bolus
-        ext_coords = get_contour_coords(struct_set.RoiGeometries[ext.Name])  # All coordinates in External geometry
+        ext_coords = set(map(tuple, get_contour_coords(case, exam, roi_geoms[ext_name]).tolist()))  # All coordinates in External geometry, as a set for fast membership tests
         gap_btwn_boli = []  # List of tuples of adjacent boli w/ a gap; e.g., [('Bolus 1', 'Bolus 2'), ('Bolus 3', 'Bolus 4')]
+
+        # Coordinates shared by each bolus and External geometries, as an (N, 3) array per bolus
+        shared_coords = []
+        for bolus in boli:
+            bolus_coords = get_contour_coords(case, exam, bolus.geom)
+            in_ext = np.fromiter((tuple(coords) in ext_coords for coords in bolus_coords.tolist()), dtype=bool, count=bolus_coords.shape[0])
+            shared_coords.append(bolus_coords[in_ext])
         
         # Iterate over each bolus, finding the adjacent (closest) bolus, as determined by smallest distance between closest two points that are also part of External
-        for bolus in boli:
-            bolus_coords = [coords for coords in get_contour_coords(bolus) if coords in ext_coords]  # All coordinates shared by bolus and External geometries
-
-            # All other boli, from which to find adjacent bolus
-            other_boli = boli[:]
-            other_boli.remove(bolus)  # Bolus can't be adjacent to itself
-
-            # Find adjacent bolus
+        for i, bolus in enumerate(boli):
             min_dist = float('Inf')  # Start min at largest possible so we'll be sure to find an adjacent bolus
             adj_bolus = None  # We don't yet have an adjacent bolus
-            gap = False  # Assume no gap between bolus and its adjacent bolus
-            for other_bolus in other_boli:
-                other_bolus_coords = [coords for coords in get_contour_coords(bolus) if coords in ext_coords]  # All coordinates shared by possible adjacent bolus, and External geometries
-                # Compare each pair of coordinates from the two boli
-                for bolus_coord in bolus_coords:
-                    for other_bolus_coord in other_bolus_coords:
-                        dist = distance(bolus_coord, other_bolus_coord)
-                        if dist < min_dist:  # We found another bolus that it's closer to
-                            min_dist = dist
-                            adj_bolus = other_bolus
-                            gap = bolus_coord not in other_bolus_coords  # There is a gap if there is no overlap; IOW, the two boli don't share the coordinate
-            if gap and (adj_bolus, bolus) not in gap_btwn_boli:  # Prevent duplicates in gap list (e.g., ('Bolus 1', 'Bolus 2') and ('Bolus 2', 'Bolus 1'))
-                gap_btwn_boli.append((bolus, adj_bolus))
+            for j, other_bolus in enumerate(boli):
+                if i == j:  # Bolus can't be adjacent to itself
+                    continue
+                dist = min_distance(shared_coords[i], shared_coords[j])
+                if dist < min_dist:  # We found another bolus that it's closer to
+                    min_dist = dist
+                    adj_bolus = other_bolus.name
+            gap = adj_bolus is not None and min_dist > 0  # There is a gap if there is no overlap; IOW, the two boli don't share the closest coordinate
+            if gap and (adj_bolus, bolus.name) not in gap_btwn_boli:  # Prevent duplicates in gap list (e.g., ('Bolus 1', 'Bolus 2') and ('Bolus 2', 'Bolus 1'))
+                gap_btwn_boli.append((bolus.name, adj_bolus))
         
         if gap_btwn_boli:
             gap_btwn_boli = [f'{pair[0]} and {pair[1]}' for pair in gap_btwn_boli]  # e.g., 'Bolus 1 and Bolus 2'
-            msg = 'There is a gap between each of the follwing pair(s) of adjacent boli:<br/>&nbsp;&nbsp;&nbsp;&nbsp;&bull;&nbsp;&nbsp;{}'.format('<br/>&nbsp;&nbsp;&nbsp;&nbsp;&bull;&nbsp;&nbsp;'.join(gap_btwn_boli))
+            msg = PlanChkConstants.bullet_msg('There is a gap between each of the follwing pair(s) of adjacent boli:', gap_btwn_boli)
             fail_msgs.append(msg)
         else:
             msg = 'There are no gaps between adjacent boli.'
@@ -796,22 +1032,25 @@ def plan_check() -> None:
     # Dose grid includes all contours (except perhaps FOV)
     # A contour extends outside dose grid if any of its min coords are less than dose grid min coordinates, or any of its max coordinates are greater than dose grid max coordinates
     outside_dg = []  # Geometries that extend outside dose grid
-    for geom in struct_set.RoiGeometries:  # Ignore empty geometries
-        if geom.HasContours() and geom.OfRoi.Type != 'FieldOfView' and not (geom.OfRoi.Type in ['Bolus', 'Fixation', 'Support'] and geom.OfRoi.RoiMaterial is not None):  # Ignore FOV, and bolus/fixation/support with material override
-            bounds = geom.GetBoundingBox()  # [{'x': min x-coord, 'y': min y-coord, 'z': min z-coord}, {'x': max x-coord, 'y': max y-coord, 'z': max z-coord}]
-            if any(bounds[0][coord] < val for coord, val in dg_min.items()) or any(bounds[1][coord] > val for coord, val in dg_max.items()):
-                outside_dg.append(geom.OfRoi.Name)
+    if dg_candidates:
+        # Bounding boxes of all candidate geometries as an (N, 2, 3) array: geometry, min/max, x/y/z
+        bbs = np.array([[[bound[dim] for dim in PlanChkConstants.DIMS] for bound in info.geom.GetBoundingBox()] for info in dg_candidates], dtype=np.float64)
+        dg_min_arr = np.array([dg_min[dim] for dim in PlanChkConstants.DIMS])
+        dg_max_arr = np.array([dg_max[dim] for dim in PlanChkConstants.DIMS])
+        outside_mask = (bbs[:, 0] < dg_min_arr).any(axis=1) | (bbs[:, 1] > dg_max_arr).any(axis=1)
+        outside_dg = [dg_candidates[idx].name for idx in np.flatnonzero(outside_mask)]
     if outside_dg:
-        msg = 'Dose grid does not include all of the following geometries:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(outside_dg)
+        msg = PlanChkConstants.bullet_msg('Dose grid does not include all of the following geometries:', outside_dg)
         warn_msgs.append(msg)
     else:
         msg = 'All necessary contours are contained inside the dose grid.'
         pass_msgs_section.append(msg)
 
     # Uniform dose grid
-    voxel_szs = ['{} = {:.0f} mm'.format(coord, sz * 10) for coord, sz in sorted(dg.VoxelSize.items())]
+    vox_sz_items = sorted(dg.VoxelSize.items())
+    voxel_szs = ['{} = {:.0f} mm'.format(coord, sz * 10) for coord, sz in vox_sz_items]  # Display strings for all voxel sizes, shared by the checks below
     if not dg.VoxelSize.x == dg.VoxelSize.y == dg.VoxelSize.z:
-        msg = 'Dose grid voxel sizes are not uniform:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(voxel_szs)
+        msg = PlanChkConstants.bullet_msg('Dose grid voxel sizes are not uniform:', voxel_szs)
         fail_msgs.append(msg)
     else:
         msg = 'Dose grid voxel sizes are uniform: x = y = z = {:.0f} mm.'.format(dg.VoxelSize.x * 10)
@@ -819,13 +1058,12 @@ def plan_check() -> None:
 
     # Dose grid voxel sizes are small enough
     max_sz = 2 if 'SBRT' in plan_types.values() or 'SRS' in plan_types.values() else 3  # 3 mm dose grid for non-SBRT, 2 mm for SBRT (incl. SRS)
-    lg_voxels = ['{} = {:.0f} mm'.format(coord, sz * 10) for coord, sz in dg.VoxelSize.items() if sz > max_sz]  # Coordinates whose voxel sizes are too large. Convert from cm to mm and display as integer, not float
+    lg_voxels = [sz_str for (_, sz), sz_str in zip(vox_sz_items, voxel_szs) if sz > max_sz]  # Coordinates whose voxel sizes are too large. Convert from cm to mm and display as integer, not float
     if lg_voxels:
-        msg = f'The following voxel sizes >{max_sz} mm:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(lg_voxels)
+        msg = PlanChkConstants.bullet_msg(f'The following voxel sizes >{max_sz} mm:', lg_voxels)
         fail_msgs.append(msg)
     else:
-        voxel_szs = ['{} = {:.0f} mm'.format(coord, sz * 10) for coord, sz in sorted(dg.VoxelSize.items())]
-        msg = f'All voxel sizes &leq;{max_sz} mm:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(voxel_szs)
+        msg = PlanChkConstants.bullet_msg(f'All voxel sizes &leq;{max_sz} mm:', voxel_szs)
         pass_msgs_section.append(msg)
 
     # Plan has Clinical Goals
@@ -843,20 +1081,25 @@ def plan_check() -> None:
         msg = 'Plan has no dose.'
         fail_msgs.append(msg)
     else:
-        failing_goals = []
+        # Goals whose ROI geometry is nonempty with up-to-date dose statistics, or whose POI geometry is defined
+        evaluable_goals = []
         for func in plan.TreatmentCourse.EvaluationSetup.EvaluationFunctions:
-            roi = func.ForRegionOfInterest
-            ok = roi.Name not in dose_stats_missing and not func.EvaluateClinicalGoal()
+            roi_name = func.ForRegionOfInterest.Name
+            if roi_name in dose_stats_missing:
+                continue
             try:
-                ok = ok and struct_set.RoiGeometries[roi.Name].HasContours()
+                ok = has_contours[roi_name]
             except KeyError:
-                ok = ok and struct_set.PoiGeometries[roi.Name].Point is not None and struct_set.PoiGeometries[roi.Name].Point.x != float('inf')
+                poi_pt = struct_set.PoiGeometries[roi_name].Point
+                ok = poi_pt is not None and poi_pt.x != float('inf')
             if ok:
-                goal_val = func.GetClinicalGoalValue()  # nan if empty or out-of-date geometry
-                failing_goals.append(goal_str(func))
+                evaluable_goals.append(func)
+
+        # Evaluate sequentially: EvaluateClinicalGoal stores its results on the goal, and the RS scripting API is not thread-safe
+        failing_goals = [goal_str(func) for func in evaluable_goals if not func.EvaluateClinicalGoal()]
 
         if failing_goals:
-            msg = 'The following Clinical Goals fail:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(failing_goals)
+            msg = PlanChkConstants.bullet_msg('The following Clinical Goals fail:', failing_goals)
             fail_msgs.append(msg)
         else:
             msg = 'All evaluable Clinical Goals pass.'
@@ -864,12 +1107,12 @@ def plan_check() -> None:
 
     # Gantry does not collide with couch or patient
     # Max distance between plan isocenter and couch/Skin should be <40 cm, at worst <41.5 cm
-    # Create cylinder geometry w/ radius 40 and 41.5, and height the diameter of the collimator
+    # Compute the bounds of a cylinder w/ radius 40 and 41.5, centered at the iso
     # Min and max couch/skin coordinates must not be outside cylinder min and max coordinates
 
     # Plan isocenter coordinates
     iso = struct_set.LocalizationPoiGeometry
-    if iso is None or iso.Point is None or any(abs(coord) == float('inf') for coord in iso.Point.values()):
+    if iso is None or iso.Point is None or is_inf_point(iso.Point):
         msg = 'Plan has no localization geometry.'
         fail_msgs.append(msg)
     else:
@@ -878,30 +1121,24 @@ def plan_check() -> None:
         pass_msgs_section.append(msg)
 
         # Bounds of couch and external
-        if not missing_couch_rois and struct_set.RoiGeometries[outer_couch_name].HasContours():
-            couch_bounds = struct_set.RoiGeometries[outer_couch_name].GetBoundingBox()
+        if not missing_couch_rois and has_contours[outer_couch_name]:
+            couch_bounds = roi_geoms[outer_couch_name].GetBoundingBox()
         else:
             couch_bounds = None
-        if ext and struct_set.RoiGeometries[ext.Name].HasContours():
-            ext_bounds = struct_set.RoiGeometries[ext.Name].GetBoundingBox()
+        if ext_name is not None and has_contours[ext_name]:
+            ext_bounds = roi_geoms[ext_name].GetBoundingBox()
         else:
             ext_bounds = None
 
-        # Create cylinder for collision checking
-        cyl_name = case.PatientModel.GetUniqueRoiName(DesiredName='zCylinder')
-        cyl = case.PatientModel.CreateRoi(Name=cyl_name, Type='Control')
-        
-        msg = will_gantry_collide(cyl, struct_set, 40, iso, 'very likely', couch_bounds, ext_bounds,)  # 40 cm cylinder
+        msg = will_gantry_collide(40, iso, 'very likely', couch_bounds, ext_bounds)  # 40 cm cylinder
         if msg is not None:
             fail_msgs.append(msg)
         else:
-            msg = will_gantry_collide(cyl, struct_set, 41.5, iso, 'likely', couch_bounds, ext_bounds,)  # 41.5 cm cylinder
+            msg = will_gantry_collide(41.5, iso, 'likely', couch_bounds, ext_bounds)  # 41.5 cm cylinder
             if msg is not None:
                 warn_msgs.append(msg)
             else:
-               pass_msgs_section.append('Distance from gantry to patient/couch &GreaterEqual;41.5 cm. Collision is unlikely.') 
-        
-        cyl.DeleteRoi()
+                pass_msgs_section.append('Distance from gantry to patient/couch &GreaterEqual;41.5 cm. Collision is unlikely.')
 
     # If there are any green case messages, add them to `pass_msgs` dict
     if pass_msgs_section:
@@ -913,7 +1150,7 @@ def plan_check() -> None:
     beam_names, beam_nums = [], []
     for c in patient.Cases:
         for p in c.TreatmentPlans:
-            if re.match(PlanChkConstants.INI_SIM_PLAN_REGEX, p.Name, re.IGNORECASE) is not None:
+            if PlanChkConstants.INI_SIM_PLAN_RE.match(p.Name) is not None:
                 continue
             for bs in p.BeamSets:
                 beam_names.extend(b.Name for b in bs.Beams)
@@ -927,24 +1164,25 @@ def plan_check() -> None:
 
         beam_set_name = beam_set.DicomPlanLabel
         plan_type = plan_types[beam_set]
+        beams = list(beam_set.Beams)  # Fetch once; each access to `beam_set.Beams` is a round trip to RayStation
         try:
             bs_rx = beam_set.Prescription.PrimaryPrescriptionDoseReference
         except:
             bs_rx = None
 
         # Beam name = beam number
-        bad_names = [f'{beam.Name} (#{beam.Number})' for beam in beam_set.Beams if beam.Name != str(beam.Number)]  # e.g., 'CCW (#2)'
+        bad_names = [f'{beam.Name} (#{beam.Number})' for beam in beams if beam.Name != str(beam.Number)]  # e.g., 'CCW (#2)'
         if bad_names:
-            msg = f'The following beam names in beam set "{beam_set_name}" are not the same as their numbers:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(bad_names)
+            msg = PlanChkConstants.bullet_msg(f'The following beam names in beam set "{beam_set_name}" are not the same as their numbers:', bad_names)
             warn_msgs.append(msg)
         else:
             msg = 'Beam names are the same as their numbers.'
             pass_msgs_section.append(msg)
 
         # Duplicate beam names
-        dup_names = [beam.Name for beam in beam_set.Beams if beam_names.count(beam.Name) > 1]
+        dup_names = [beam.Name for beam in beams if beam_names.count(beam.Name) > 1]
         if dup_names:
-            msg = f'The following beam names in beam set "{beam_set_name}" exist in other cases or plans or as setup beam names in the current plan:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(dup_names)
+            msg = PlanChkConstants.bullet_msg(f'The following beam names in beam set "{beam_set_name}" exist in other cases or plans or as setup beam names in the current plan:', dup_names)
             fail_msgs.append(msg)
         else:
             msg = 'No beam name already exists.'
@@ -954,16 +1192,16 @@ def plan_check() -> None:
         sbs = beam_set.PatientSetup.SetupBeams
         dup_names = [sb.Name for sb in sbs if beam_names.count(sb.Name) > 1]
         if dup_names:
-            msg = f'The following setup beam names in beam set "{beam_set_name}" exist in other cases or plans or as beam names in the current plan:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(dup_names)
+            msg = PlanChkConstants.bullet_msg(f'The following setup beam names in beam set "{beam_set_name}" exist in other cases or plans or as beam names in the current plan:', dup_names)
             fail_msgs.append(msg)
         else:
             msg = 'No setup beam name already exists.'
             pass_msgs_section.append(msg)
 
         # Duplicate beam numbers
-        dup_nums = [str(beam.Number) for beam in beam_set.Beams if beam_nums.count(beam.Number) > 1]
+        dup_nums = [str(beam.Number) for beam in beams if beam_nums.count(beam.Number) > 1]
         if dup_nums:
-            msg = f'The following beam numbers in beam set "{beam_set_name}" exist in other cases or plans or as setup beam numbers in the current plan:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(dup_nums)
+            msg = PlanChkConstants.bullet_msg(f'The following beam numbers in beam set "{beam_set_name}" exist in other cases or plans or as setup beam numbers in the current plan:', dup_nums)
             fail_msgs.append(msg)
         else:
             msg = 'No beam number already exists.'
@@ -972,7 +1210,7 @@ def plan_check() -> None:
         # Duplicate setup beam numbers
         dup_nums = [str(sb.Number) for sb in sbs if beam_nums.count(sb.Number) > 1]
         if dup_nums:
-            msg = f'The following setup beam names in beam set "{beam_set_name}" exist in other cases or plans or as beam numbers in the current plan:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(dup_nums)
+            msg = PlanChkConstants.bullet_msg(f'The following setup beam names in beam set "{beam_set_name}" exist in other cases or plans or as beam numbers in the current plan:', dup_nums)
             fail_msgs.append(msg)
         else:
             msg = 'No setup beam number already exists.'
@@ -994,7 +1232,7 @@ def plan_check() -> None:
             warn_msgs.append(msg) 
 
         # Machine is ELEKTA or SBRT 6MV
-        machine = 'SBRT 6MV' if plan_type in ['SRS', 'SBRT'] else 'ELEKTA'
+        machine = 'SBRT 6MV' if plan_type in PlanChkConstants.SRS_TYPES else 'ELEKTA'
         if beam_set.MachineReference.MachineName != machine:
             msg = f'Machine for beam set "{beam_set_name}" should be "{machine}", not "{beam_set.MachineReference.MachineName}".'
             fail_msgs.append(msg)
@@ -1003,13 +1241,18 @@ def plan_check() -> None:
             pass_msgs_section.append(msg)
            
         # z-coordinate of beam isos between -100 and 100
-        lg_z = [f'{beam.Name} ({format_num(beam.Isocenter.Position.z)} cm)' for beam in beam_set.Beams if abs(beam.Isocenter.Position.z) > 100]  # e.g., '2 (105 cm)'
+        z, lg_z = [], []  # All beams, and beams whose iso z-coordinate is too large
+        for beam in beams:
+            iso_z = beam.Isocenter.Position.z
+            z_str = f'{beam.Name} ({format_num(iso_z)} cm)'  # e.g., '2 (105 cm)'
+            z.append(z_str)
+            if abs(iso_z) > 100:
+                lg_z.append(z_str)
         if lg_z:
-            msg = f'The following beams in beam set "{beam_set_name}" have isocenter z-coordinate > 100 cm:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(lg_z)
+            msg = PlanChkConstants.bullet_msg(f'The following beams in beam set "{beam_set_name}" have isocenter z-coordinate > 100 cm:', lg_z)
             fail_msgs.append(msg)
         else:
-            z = [f'{beam.Name} ({format_num(beam.Isocenter.Position.z)} cm)' for beam in beam_set.Beams]
-            msg = 'All beams have isocenter z-coordinate &leq; 100 cm:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(z)
+            msg = PlanChkConstants.bullet_msg('All beams have isocenter z-coordinate &leq; 100 cm:', z)
             pass_msgs_section.append(msg)        
 
         # Beam set has Rx
@@ -1034,17 +1277,19 @@ def plan_check() -> None:
             if bs_rx is not None:  # There is an Rx, and it is to volume or to point
                 if bs_rx.PrescriptionType == 'DoseAtVolume':  # Rx to volume
                     roi = bs_rx.OnStructure  # PTV
+                    roi_geom = roi_geoms[roi.Name]
                     dsp_roi = 'PTV'
                 else:  # Rx to point
                     roi_name = case.PatientModel.GetUniqueRoiName(DesiredName='IDL_80%')
                     roi = case.PatientModel.CreateRoi(Name=roi_name, Type='Control')  # Create ROI
                     roi.CreateRoiGeometryFromDose(DoseDistribution=dose_dist, ThresholdLevel=0.8 * bs_rx.DoseValue)  # Set geometry to isodose line for 80% of the Rx
+                    roi_geom = struct_set.RoiGeometries[roi_name]  # New ROI is not in `roi_geoms`
                     dsp_roi = '80% isodose line'
 
-                roi_bounds = struct_set.RoiGeometries[roi.Name].GetBoundingBox()
+                roi_bounds = roi_geom.GetBoundingBox()
                 bad_dsps = []
                 for dsp in beam_set.DoseSpecificationPoints:
-                    if any(dsp.Coordinates[coord] < val for coord, val in roi_bounds[0].items()) or any(dsp.Coordinates[coord] > val for coord, val in roi_bounds[1].items()):
+                    if is_outside_box(dsp.Coordinates, roi_bounds[0], roi_bounds[1]):
                         bad_dsps.append(f'{dsp.Name}: {format_coords(dsp.Coordinates)}')
 
                 # Delete IDL ROI
@@ -1052,7 +1297,7 @@ def plan_check() -> None:
                     roi.DeleteRoi() 
 
                 if bad_dsps:
-                    msg = f'The following DSPs for beam set "{beam_set_name}" are outside the {dsp_roi}:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(bad_dsps)
+                    msg = PlanChkConstants.bullet_msg(f'The following DSPs for beam set "{beam_set_name}" are outside the {dsp_roi}:', bad_dsps)
                     fail_msgs.append(msg)
                 else:
                     msg = f'All DSPs are inside the {dsp_roi}.'
@@ -1061,22 +1306,27 @@ def plan_check() -> None:
         # Iso has not been changed from initial sim
         if ini_sim_plan is not None and ini_sim_plan.BeamSets[0].Beams.Count > 0:  # Assume a single beam set in initial sim plan
             ini_sim_iso = ini_sim_plan.BeamSets[0].Beams[0].Isocenter  # Assume all beams in ini sim beam set have same iso
+            ini_sim_iso_str = format_coords(ini_sim_iso.Position)
             loc_pt = beam_set.GetStructureSet().LocalizationPoiGeometry
-            if loc_pt is None or loc_pt.Point is None or any(abs(coord) == float('inf') for coord in loc_pt.Point.values()):
-                iso_chged = [f'{b.Name}: {b.Isocenter.Annotation.Name} {format_coords(b.Isocenter.Position)}'for b in beam_set.Beams if format_coords(b.Isocenter.Position) != format_coords(ini_sim_iso.Position)]
+            if loc_pt is None or loc_pt.Point is None or is_inf_point(loc_pt.Point):
+                iso_chged = []
+                for b in beams:
+                    iso_str = format_coords(b.Isocenter.Position)
+                    if iso_str != ini_sim_iso_str:
+                        iso_chged.append(f'{b.Name}: {b.Isocenter.Annotation.Name} {iso_str}')
                 if iso_chged:
-                    msg = f'Isocenter coordinates for the following beams in beam set "{beam_set_name}" were changed from initial sim:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(iso_chged)
+                    msg = PlanChkConstants.bullet_msg(f'Isocenter coordinates for the following beams in beam set "{beam_set_name}" were changed from initial sim:', iso_chged)
                     warn_msgs.append(msg)
                 else:
-                    msg = f'No isocenter coordinates were changed from initial sim {format_coords(ini_sim_iso.Position)}.'
+                    msg = f'No isocenter coordinates were changed from initial sim {ini_sim_iso_str}.'
                     pass_msgs_section.append(msg)
             else:
-                loc_pt = loc_pt.Point
-                if format_coords(loc_pt) != format_coords(ini_sim_iso.Position):
-                    msg = f'Loc point coordinates for beam set "{beam_set_name}" {format_coords(loc_pt)} were changed from initial sim iso coordinates {format_coords(ini_sim_iso.Position)}'
+                loc_pt_str = format_coords(loc_pt.Point)
+                if loc_pt_str != ini_sim_iso_str:
+                    msg = f'Loc point coordinates for beam set "{beam_set_name}" {loc_pt_str} were changed from initial sim iso coordinates {ini_sim_iso_str}'
                     warn_msgs.append(msg)
                 else:
-                    msg = f'Loc point coordinates and initial sim iso coordinates {format_coords(ini_sim_iso.Position)} are the same.'
+                    msg = f'Loc point coordinates and initial sim iso coordinates {ini_sim_iso_str} are the same.'
                     pass_msgs_section.append(msg)
           
         # Dose algorithm is Collapsed Cone (CCDose)
@@ -1097,27 +1347,63 @@ def plan_check() -> None:
             pass_msgs_section.append(msg)
 
         # The following checks are for VMAT (incl. SRS, SBRT) only
-        if plan_type in ['VMAT', 'SRS', 'SBRT']:
+        if plan_type in PlanChkConstants.VMAT_TYPES:
+            # Optimization settings that are used more than once
+            opt_params = opt.OptimizationParameters
+            opt_tol = opt_params.Algorithm.OptimalityTolerance
+            tss = opt_params.TreatmentSetupSettings[0]
+            seg_arc_props = tss.SegmentConversion.ArcConversionProperties
+
+            # Per-beam VMAT checks: beam energy = 6 MV, gantry spacing <=3 cm, max delivery time <=120 or 180 s, and actual delivery time w/in 10% of max
+            # Make a single pass over the beams, reading each beam attribute once for all checks
+            max_del_time = 180 if plan_type in PlanChkConstants.SRS_TYPES else 120
+            bad_energy, bad_gantry_spacing, gantry_spacing, bad_max_del, max_del, bad_del_time, ok_del_time = [], [], [], [], [], [], []
+            for j, beam in enumerate(beams):
+                beam_name = beam.Name
+                energy = beam.BeamQualityId
+                if energy != '6':
+                    bad_energy.append(f'{beam_name} ({energy} MV)')  # e.g., 'CCW (18 MV)'
+                arc_props = tss.BeamSettings[j].ArcConversionPropertiesPerBeam
+                spacing = arc_props.FinalArcGantrySpacing
+                spacing_str = f'{beam_name} ({format_num(spacing)}&deg;)'
+                gantry_spacing.append(spacing_str)
+                if spacing > 3:
+                    bad_gantry_spacing.append(spacing_str)
+                beam_max_del = arc_props.MaxArcDeliveryTime
+                max_del_str = f'{beam_name} ({format_num(beam_max_del)} s)'
+                max_del.append(max_del_str)
+                if beam_max_del > max_del_time:
+                    bad_max_del.append(max_del_str)
+                segs = list(beam.Segments)
+                weights = np.fromiter((s.RelativeWeight for s in segs), dtype=np.float64, count=len(segs))
+                dose_rates = np.fromiter((s.DoseRate for s in segs), dtype=np.float64, count=len(segs))
+                nonzero = dose_rates != 0  # Ignore segments w/ zero dose rate
+                del_time = round_half_up(60 * beam.BeamMU * (weights[nonzero] / dose_rates[nonzero]).sum())
+                del_time_str = f'{beam_name} ({format_num(del_time)} s)'
+                if del_time > max_del_time * 1.1:
+                    bad_del_time.append(del_time_str)
+                else:
+                    ok_del_time.append(del_time_str)
+
             # Beam energy = 6 MV
-            bad_energy = [f'{beam.Name} ({beam.BeamQualityId} MV)' for beam in beam_set.Beams if beam.BeamQualityId != '6']  # e.g., 'CCW (18 MV)'
             if bad_energy:
-                msg = f'The following beam energies in beam set "{beam_set_name}" should be 6 MV:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(bad_energy)
+                msg = PlanChkConstants.bullet_msg(f'The following beam energies in beam set "{beam_set_name}" should be 6 MV:', bad_energy)
                 fail_msgs.append(msg)
             else:
                 msg = 'All beam energies are 6 MV.'
                 pass_msgs_section.append(msg)    
 
             # Optimization tolerance <=10^-5
-            if opt.OptimizationParameters.Algorithm.OptimalityTolerance > 0.0001:
-                msg = f'Optimization tolerance for beam set "{beam_set_name}" = {format_num(opt.OptimizationParameters.Algorithm.OptimalityTolerance)} > 10<sup>-5</sup>.'
+            if opt_tol > 0.0001:
+                msg = f'Optimization tolerance for beam set "{beam_set_name}" = {format_num(opt_tol)} > 10<sup>-5</sup>.'
                 fail_msgs.append(msg)
             else:
-                msg = f'Optimization tolerance = {format_num(opt.OptimizationParameters.Algorithm.OptimalityTolerance)} &leq; 10<sup>-5</sup>.'
+                msg = f'Optimization tolerance = {format_num(opt_tol)} &leq; 10<sup>-5</sup>.'
                 pass_msgs_section.append(msg)
 
             # Compute Intermediate Dose is checked
-            if any(re.search(r'(^|[^A-Za-z])lung([^A-Za-z]|$)', attr, re.IGNORECASE) is not None for attr in [beam_set_name, plan.Name, case.CaseName, case.BodySite]):
-                if not opt.OptimizationParameters.DoseCalculation.ComputeIntermediateDose:
+            if any(contains_word(attr, 'lung') for attr in (beam_set_name, plan.Name, case.CaseName, case.BodySite)):
+                if not opt_params.DoseCalculation.ComputeIntermediateDose:
                     msg = f'"Compute intermediate dose" is unchecked for beam set "{beam_set_name}".'
                     warn_msgs.append(msg)
                 else:
@@ -1125,45 +1411,31 @@ def plan_check() -> None:
                     pass_msgs_section.append(msg)
 
             # Gantry spacing <=3 cm
-            tss = opt.OptimizationParameters.TreatmentSetupSettings[0]
-            bad_gantry_spacing = [f'{beam.Name} ({format_num(tss.BeamSettings[j].ArcConversionPropertiesPerBeam.FinalArcGantrySpacing)}&deg;)' for j, beam in enumerate(beam_set.Beams) if tss.BeamSettings[j].ArcConversionPropertiesPerBeam.FinalArcGantrySpacing > 3]
             if bad_gantry_spacing:
-                msg = f'The following beams in beam set "{beam_set_name}" have gantry spacing >3&deg;:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(bad_gantry_spacing)
+                msg = PlanChkConstants.bullet_msg(f'The following beams in beam set "{beam_set_name}" have gantry spacing >3&deg;:', bad_gantry_spacing)
                 fail_msgs.append(msg)
             else:
-                gantry_spacing = [f'{beam.Name} ({format_num(tss.BeamSettings[j].ArcConversionPropertiesPerBeam.FinalArcGantrySpacing)}&deg;)' for j, beam in enumerate(beam_set.Beams)]
-                msg = 'All beams have gantry spacing &leq; 3&deg;:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(gantry_spacing)
+                msg = PlanChkConstants.bullet_msg('All beams have gantry spacing &leq; 3&deg;:', gantry_spacing)
                 pass_msgs_section.append(msg)
 
             # Max delivery time <=120 or 180 s
-            max_del_time = 180 if plan_type in ['SRS', 'SBRT'] else 120
-            bad_max_del = [f'{beam.Name} ({format_num(tss.BeamSettings[j].ArcConversionPropertiesPerBeam.MaxArcDeliveryTime)} s)' for j, beam in enumerate(beam_set.Beams) if tss.BeamSettings[j].ArcConversionPropertiesPerBeam.MaxArcDeliveryTime > max_del_time]
             if bad_max_del:
-                msg = f'The following beams in beam set "{beam_set_name}" have max delivery time >{max_del_time} s:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(bad_max_del)
+                msg = PlanChkConstants.bullet_msg(f'The following beams in beam set "{beam_set_name}" have max delivery time >{max_del_time} s:', bad_max_del)
                 fail_msgs.append(msg)
             else:
-                max_del = [f'{beam.Name} ({format_num(tss.BeamSettings[j].ArcConversionPropertiesPerBeam.MaxArcDeliveryTime)} s)' for j, beam in enumerate(beam_set.Beams)]
-                msg = f'All beams have max delivery time &leq;{max_del_time} s:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(max_del)
+                msg = PlanChkConstants.bullet_msg(f'All beams have max delivery time &leq;{max_del_time} s:', max_del)
                 pass_msgs_section.append(msg)
 
             # Actual delivery time w/in 10% of what max should be
-            bad_del_time, ok_del_time = [], []
-            for b in beam_set.Beams:
-                del_time = int(round(60 * b.BeamMU * sum(s.RelativeWeight / s.DoseRate for s in b.Segments if s.DoseRate != 0))) 
-                del_time_str = f'{b.Name} ({format_num(del_time)} s)'
-                if del_time > max_del_time * 1.1:
-                    bad_del_time.append(del_time_str)
-                else:
-                    ok_del_time.append(del_time_str)
             if bad_del_time:
-                msg = f'The following beams in beam set "{beam_set_name}" have delivery time >{max_del_time} s + 10%:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(bad_del_time)
+                msg = PlanChkConstants.bullet_msg(f'The following beams in beam set "{beam_set_name}" have delivery time >{max_del_time} s + 10%:', bad_del_time)
                 fail_msgs.append(msg)
             else:
-                msg = f'All beams have delivery time &leq;{max_del_time} s + 10%:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(ok_del_time)
+                msg = PlanChkConstants.bullet_msg(f'All beams have delivery time &leq;{max_del_time} s + 10%:', ok_del_time)
                 pass_msgs_section.append(msg)
 
             # Constraint on max leaf distance per degree is enabled
-            if not tss.SegmentConversion.ArcConversionProperties.UseMaxLeafTravelDistancePerDegree:
+            if not seg_arc_props.UseMaxLeafTravelDistancePerDegree:
                 msg = f'Constraint on leaf motion per degree is disabled for beam set "{beam_set_name}".'
                 fail_msgs.append(msg)
             else:
@@ -1171,103 +1443,70 @@ def plan_check() -> None:
                 pass_msgs_section.append(msg)
 
                 # Max distance per degree <=0.5 cm (only applies if this constraint is enabled)
-                if tss.SegmentConversion.ArcConversionProperties.MaxLeafTravelDistancePerDegree > 0.5:
-                    msg = f'Max leaf motion per degree = {format_num(tss.SegmentConversion.ArcConversionProperties.MaxLeafTravelDistancePerDegree)} > 0.5 cm/deg for beam set "{beam_set_name}".'
+                max_leaf_travel = seg_arc_props.MaxLeafTravelDistancePerDegree
+                if max_leaf_travel > 0.5:
+                    msg = f'Max leaf motion per degree = {format_num(max_leaf_travel)} > 0.5 cm/deg for beam set "{beam_set_name}".'
                     fail_msgs.append(msg)
                 else:
-                    msg = f'Max leaf motion per degree = {format_num(tss.SegmentConversion.ArcConversionProperties.MaxLeafTravelDistancePerDegree)} &leq; 0.5 cm/deg.'
+                    msg = f'Max leaf motion per degree = {format_num(max_leaf_travel)} &leq; 0.5 cm/deg.'
                     pass_msgs_section.append(msg)
 
-        if bs_rx is not None and beam_set.FractionationPattern is not None and beam_set.FractionDose.DoseValues is not None:
+        fx_dose = beam_set.FractionDose
+        if ext_name is not None and bs_rx is not None and beam_set.FractionationPattern is not None and fx_dose.DoseValues is not None:
             # Max dose
-            dose_per_fx = float(bs_rx.DoseValue) / beam_set.FractionationPattern.NumberOfFractions
-            max_dose = int(round(beam_set.FractionDose.GetDoseStatistic(RoiName=ext.Name, DoseType='Max') / dose_per_fx * 100))
-            if plan_type in ['SRS', 'SBRT']:
-                if max_dose > 125:
-                    if max_dose > 140:
-                        msg = f'Max dose for beam set "{beam_set_name}" = {max_dose}% > 140% Rx'
-                        fail_msgs.append(msg)
-                    else:
-                        msg = f'Max dose for beam set "{beam_set_name}" = {max_dose}% > 125% Rx. This may be okay since it is below 140.'
-                        warn_msgs.append(msg)
-                else:
-                    msg = f'Max dose = {max_dose}% &LessEqual; 125% Rx.'
-                    pass_msgs_section.append(msg)
-            elif plan_type == 'VMAT':
-                if max_dose > 108:
-                    if max_dose > 110:
-                        msg = f'Max dose for beam set "{beam_set_name}" = {max_dose}% > 110% Rx.'
-                        fail_msgs.append(msg)
-                    else:
-                        msg = f'Max dose for beam set "{beam_set_name}" = {max_dose}% Rx. Ideal is 107&ndash;108%, but {max_dose}% may be okay since it &leq; 110.'
-                        warn_msgs.append(msg)
-                else:
-                    msg = f'Max dose = {max_dose}% &leq; 108% Rx.'
-                    pass_msgs_section.append(msg)
+            pct_per_cgy = 100.0 * beam_set.FractionationPattern.NumberOfFractions / bs_rx.DoseValue  # Converts a fraction dose to % of Rx: 100 / (Rx dose per fraction)
+            max_dose = round_half_up(fx_dose.GetDoseStatistic(RoiName=ext_name, DoseType='Max') * pct_per_cgy)
+            warn_thresh, fail_thresh, warn_note = PlanChkConstants.MAX_DOSE_THRESHOLDS.get(plan_type, PlanChkConstants.MAX_DOSE_THRESHOLDS[None])
+            if max_dose > fail_thresh:
+                msg = f'Max dose for beam set "{beam_set_name}" = {max_dose}% > {fail_thresh}% Rx.'
+                fail_msgs.append(msg)
+            elif max_dose > warn_thresh:
+                msg = f'Max dose for beam set "{beam_set_name}" = {max_dose}% > {warn_thresh}% Rx.'
+                if warn_note is not None:
+                    msg += f' {warn_note}'
+                msg += f' This may be okay since it &leq; {fail_thresh}.'
+                warn_msgs.append(msg)
             else:
-                if max_dose > 110:
-                    if max_dose > 118:
-                        msg = f'Max dose for beam set "{beam_set_name}" = {max_dose}% > 118% Rx.'
-                        fail_msgs.append(msg)
-                    else:
-                        msg = f'Max dose for beam set "{beam_set_name}" = {max_dose}% > 110% Rx. This may be okay since it &leq; 118.'
-                        warn_msgs.append(msg)
-                else:
-                    msg = f'Max dose = {max_dose}% &leq; 110% Rx.'
-                    pass_msgs_section.append(msg)
+                msg = f'Max dose = {max_dose}% &leq; {warn_thresh}% Rx.'
+                pass_msgs_section.append(msg)
             
-            if plan_type in ['VMAT', 'SRS', 'SBRT']:
+            if plan_type in PlanChkConstants.VMAT_TYPES:
                 # Beam MU >= 110% beam dose
                 too_modulated, modulation_ok = [], []
-                for i, beam in enumerate(beam_set.Beams):
+                beam_doses = list(fx_dose.BeamDoses)
+                for beam, beam_dose in zip(beams, beam_doses):
                     mu = beam.BeamMU
-                    dose = beam_set.FractionDose.BeamDoses[i].DoseAtPoint.DoseValue
-                    msg = f'{beam.Name} ({mu:.0f} MU, {dose:.0f} cGy dose)'
+                    dose = beam_dose.DoseAtPoint.DoseValue
                     if mu < 1.1 * dose:
-                        too_modulated.append(msg)
-                    elif not too_modulated:
-                        modulation_ok.append(msg)
+                        too_modulated.append(f'{beam.Name} ({mu:.0f} MU, {dose:.0f} cGy dose)')
+                    elif not too_modulated:  # Pass message is unused once any beam fails
+                        modulation_ok.append(f'{beam.Name} ({mu:.0f} MU, {dose:.0f} cGy dose)')
                 if too_modulated:
-                    msg = f'The following beams in beam set "{beam_set_name}" may be too modulated:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(too_modulated)
+                    msg = PlanChkConstants.bullet_msg(f'The following beams in beam set "{beam_set_name}" may be too modulated:', too_modulated)
                     warn_msgs.append(msg)
                 else:
-                    msg = 'Modulation is appropriate for all beams:' + PlanChkConstants.NEWLINE_AND_BULLET + PlanChkConstants.NEWLINE_AND_BULLET.join(modulation_ok)
+                    msg = PlanChkConstants.bullet_msg('Modulation is appropriate for all beams:', modulation_ok)
                     pass_msgs_section.append(msg)
 
         if pass_msgs_section:
             pass_msgs[f'Beam Set "{beam_set_name}":'] = pass_msgs_section
 
-    # Add red messages
-    if fail_msgs:
-        elems.extend([Paragraph('Errors:', style=PlanChkConstants.STYLES['Heading3']), PlanChkConstants.SPCR_SM])
-        for msg in fail_msgs:
-            elems.extend([Paragraph(msg, style=PlanChkConstants.STYLES[PlanChkConstants.FAIL]), PlanChkConstants.SPCR_LG])
-
-    # Add yellow messages
-    if warn_msgs:
-        elems.extend([Paragraph('Warnings:', style=PlanChkConstants.STYLES['Heading3']), PlanChkConstants.SPCR_SM])
-        for msg in warn_msgs:
-            elems.extend([Paragraph(msg, style=PlanChkConstants.STYLES[PlanChkConstants.WARN]), PlanChkConstants.SPCR_LG])
-
-    # Add green messages
+    # Add red, yellow, and green messages
+    for heading, msgs, msg_style in (('Errors:', fail_msgs, fail_style), ('Warnings:', warn_msgs, warn_style)):
+        if msgs:
+            add_section(elems, heading, hdg3_style, msgs, msg_style)
     if pass_msgs:
-        elems.extend([Paragraph('Passing:', style=PlanChkConstants.STYLES['Heading3']), PlanChkConstants.SPCR_SM])
+        add_section(elems, 'Passing:', hdg3_style, [], pass_style)
         for heading, msgs in pass_msgs.items():
-            elems.extend([Paragraph(heading, style=PlanChkConstants.STYLES['Heading4']), PlanChkConstants.SPCR_SM])
-            
-            for msg in msgs:
-                elems.extend([Paragraph(msg, style=PlanChkConstants.STYLES[PlanChkConstants.PASS]), PlanChkConstants.SPCR_LG])
+            add_section(elems, heading, hdg4_style, msgs, pass_style)
 
     ## 'Manual Checks:' section
-
-    # Section header
-    elems.extend([Paragraph('Manual Checks:', style=PlanChkConstants.STYLES['Heading3']), PlanChkConstants.SPCR_SM])
     
     # Messages to display in blue
     manual_msgs = ['Is admission date filled in in MOSAIQ? If not, ask the front desk to enter it.', 'Did the MD request any dose sums? Are they present in RS?', 'Are structures excluded from MOSAIQ export, and invisible? You may run script "Exclude from MOSAIQ Export".']
     
     # If any VMAT (incl. SRS, SBRT) plans, view MLC movie
-    if any(plan_type in plan_types.values() for plan_type in ['VMAT', 'SRS', 'SBRT']):  
+    if not PlanChkConstants.VMAT_TYPES.isdisjoint(plan_types.values()):
         manual_msgs.append('View MLC movie. There should be no weird/unexpected MLC positions, and MLC should approximately conform to PTV size.')
     
     # If Rx isodose is not 100%, remind user to double check MOSAIQ for this change
@@ -1277,17 +1516,16 @@ def plan_check() -> None:
         if rx.PrescriptionType == 'DoseAtVolume' and rx.DoseVolume != 100:
             manual_msgs.extend([f'Is the Rx in MOSAIQ titled "{plan.Name}" to match the RS plan name?', f'The current beam set\'s primary Rx is to {format_num(rx.DoseVolume)}% volume, not 100%. Does this match in D and I in MOSAIQ?'])
     
-    # Create blue check for each message
-    for msg in manual_msgs:
-        elems.extend([Paragraph(msg, style=PlanChkConstants.STYLES[PlanChkConstants.MANUAL]), PlanChkConstants.SPCR_LG])
+    # Section header and blue check for each message
+    add_section(elems, 'Manual Checks:', hdg3_style, manual_msgs, manual_style)
 
     # Build PDF.
-    pdf.build([KeepTogether(elem) for elem in elems])
+    pdf.build(elems)
     
-    # Open report
+    # Open report in the first Adobe Reader that is installed, or in the default PDF viewer if none is
     for reader_path in PlanChkConstants.ADOBE_READER_PATHS:
-        try:
-            os.system(fr'START /B "{reader_path}" "{filepath}"')
+        if os.path.isfile(reader_path):
+            subprocess.Popen([reader_path, filepath], creationflags=subprocess.DETACHED_PROCESS)  # Don't wait on, or spawn a shell for, the reader
             break
-        except:
-            continue
+    else:
+        os.startfile(filepath)
@@ -1,11 +1,15 @@
 """This script builds on PaddickAndHomogeneity_10 from RaySearch support"""
 import clr
 from datetime import datetime
+import glob
+import json
 import os
 import random
 import re
+import subprocess
 import sys
-from typing import Optional
+from typing import Dict, Optional, Set
+from xml.sax.saxutils import escape
 
 from connect import *
 from connect.connect_cpython import PyScriptObject
@@ -14,10 +18,11 @@ import pandas as pd
 
 import reportlab.lib.colors
 from reportlab.lib.colors import black, Color, dimgray, lightgrey, white
+from reportlab.lib.enums import TA_CENTER
 from reportlab.lib.pagesizes import letter, landscape
 from reportlab.platypus import SimpleDocTemplate, Paragraph
 from reportlab.platypus.flowables import KeepTogether
-from reportlab.platypus.tables import Table, TableStyle
+from reportlab.platypus.tables import LongTable, TableStyle
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 
@@ -25,6 +30,58 @@ clr.AddReference('System.Windows.Forms')
 from System.Windows.Forms import MessageBox
 
 
+def read_tg263_colors(path: str) -> Dict[str, str]:
+    """Reads the TG-263 names and colors from the given spreadsheet
+
+    Parsing the workbook is slow, so the result is cached in a JSON file next to the workbook
+    The cache file name includes the workbook's modification time, so the workbook is re-read only after it changes
+    If the cache file cannot be read or written (e.g., no write access to the directory), the workbook is read normally
+
+    Argument
+    --------
+    path: Absolute path to the TG-263 spreadsheet
+
+    Returns
+    -------
+    Dictionary of TG-263 name : color formatted as 'A, R, G, B'
+    """
+    base_path = os.path.splitext(path)[0]
+    cache_path = f'{base_path}.{os.stat(path).st_mtime_ns}.colors.json'  # e.g., '.../TG-263 Nomenclature with CRMC Colors.1650000000000000000.colors.json'
+    try:
+        with open(cache_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):  # No cache yet, or the cache is unreadable
+        pass
+
+    read_kwargs = {'sheet_name': 'Names & Colors', 'usecols': ['TG-263 Primary Name', 'Color'], 'dtype': {'TG-263 Primary Name': 'string', 'Color': 'string'}}
+    try:
+        tg263_colors = pd.read_excel(path, engine='calamine', **read_kwargs)  # Much faster than openpyxl, if python-calamine is installed
+    except (ImportError, ValueError):  # python-calamine is not installed, or pandas is too old to support it
+        tg263_colors = pd.read_excel(path, engine='openpyxl', **read_kwargs)
+    tg263_colors.dropna(inplace=True)  # Ignore blank rows and names without colors
+    tg263_colors = dict(zip(tg263_colors['TG-263 Primary Name'], tg263_colors['Color'].str.slice(1, -1)))  # Remove parens from colors
+
+    # Write the cache to a temporary file and then move it into place, so that a concurrent run never reads a partially written cache
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(tg263_colors, f)
+        os.replace(tmp_path, cache_path)
+    except OSError:  # E.g., no write access to the directory
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        return tg263_colors
+
+    # Delete caches for older versions of the workbook (including pickle caches written by older versions of this script)
+    for old_cache_path in glob.glob(f'{glob.escape(base_path)}.*.colors.json') + glob.glob(f'{glob.escape(base_path)}.*.colors.pkl'):
+        if old_cache_path != cache_path:
+            try:
+                os.remove(old_cache_path)
+            except OSError:  # E.g., another run already deleted it
+                pass
+    return tg263_colors
+
+
 class PlanQualConstants(object):
     """Class that defines several useful constants for this remainder of the script"""
 
@@ -34,21 +91,32 @@ class PlanQualConstants(object):
     # This directory does not have to already exist
     OUTPUT_DIR = os.path.join('T:', os.sep, 'Physics', 'Scripts', 'Output Files', 'Plan Quality Metrics')
 
-    # DataFrame of colors from our enhanced TG-263 spreadsheet
-    # Indexes ("keys") are the TG-263 names
-    TG263_COLORS = pd.read_excel(os.path.join('T:', os.sep, 'Physics', 'KW', 'med-phys-spreadsheets', 'Structure Names & Colors', 'TG-263 Nomenclature with CRMC Colors.xlsm'), sheet_name='Names & Colors', usecols=['TG-263 Primary Name', 'Color'])
-    TG263_COLORS.set_index('TG-263 Primary Name', drop=True, inplace=True)
-    TG263_COLORS['Color'] = TG263_COLORS['Color'].apply(lambda x: x[1:-1])  # Remove parens
-    
+    # Absolute path to our enhanced TG-263 spreadsheet
+    TG263_PATH = os.path.join('T:', os.sep, 'Physics', 'KW', 'med-phys-spreadsheets', 'Structure Names & Colors', 'TG-263 Nomenclature with CRMC Colors.xlsm')
+
+    # Dictionary of TG-263 name : color from the TG-263 spreadsheet
+    TG263_COLORS = read_tg263_colors(TG263_PATH)
+
     # --------------------------- No changes necessary --------------------------- #
 
     STYLES = getSampleStyleSheet()  # Base ReportLab styles (e.g., 'Heading1', 'Normal')
+    TBL_NAME_STYLE = ParagraphStyle('TblName', parent=STYLES['Normal'], alignment=TA_CENTER)  # Beam set and target name cells, which wrap to fit their columns
+
+    # RayStation ROI algebra margin settings for no expansion or contraction
+    NO_MARGIN = {'Type': 'Expand', 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0}
+
+    # Compiled regular expression
+    INVALID_FILENAME_CHARS_RE = re.compile(r'[<>:"/\\\|\?\*]')  # Characters not allowed in Windows filenames
+
+    # Metrics table column widths (sum to 10.5", which fits in the 10.55" available between the margins)
+    # Explicit widths spare ReportLab from measuring every cell to size the columns. Row heights are still computed, so that wrapped text fits
+    TBL_COL_WIDTHS = [w * inch for w in (1.0, 1.2, 0.9, 0.8, 0.8, 0.8, 0.7, 1.55, 0.85, 0.85, 1.05)]  # Coverage column fits e.g. '100.00% at 6000 cGy' on one line
 
     # Paths to Adobe Reader on RS servers
     ADOBE_READER_PATHS = [os.path.join('C:', os.sep, 'Program Files (x86)', 'Adobe', 'Reader 11.0', 'Reader', 'AcroRd32.exe'), os.path.join('C:', os.sep, 'Program Files (x86)', 'Adobe', 'Acrobat Reader DC', 'Reader', 'AcroRd32.exe')]
 
 
-def create_dlv_roi(patient: PyScriptObject, case: PyScriptObject, exam: PyScriptObject, target_name: str, idl_roi_name: str, exp_sz: Optional[float] = 2) -> PyScriptObject:
+def create_dlv_roi(patient: PyScriptObject, case: PyScriptObject, used_colors: Set[str], exam: Optional[PyScriptObject], target_name: str, idl_roi_name: str, exp_sz: Optional[float] = 2) -> PyScriptObject:
     """Creates a dose-limiting-volume (DLV) ROI that is the intersection of the given target expansion and the given isodose line (IDL) ROI
 
     The DLV ROI is named "z<target name>_DLV<expansion in mm>"
@@ -57,7 +125,9 @@ def create_dlv_roi(patient: PyScriptObject, case: PyScriptObject, exam: PyScript
     ---------
     patient: The patient to whom the ROIs belong
     case: The case to which the ROIs belong
+    used_colors: The colors already used in the case or by TG-263, for generating a unique DLV ROI color
     exam: The examination on which to update the derived ROI geometry
+          If None, the geometry is not updated, so that the caller can update several derived geometries in one call
     target_name: The name of the target whose expansion to use in the DLV ROI algebra expression
     idl_roi_name: The name of the IDL (Dose Region) ROI to use in the DLV ROI algebra expression
     exp_sz: The uniform target expansion, in cm, to apply to the target in the DLV ROI algebra expression
@@ -69,11 +139,11 @@ def create_dlv_roi(patient: PyScriptObject, case: PyScriptObject, exam: PyScript
 
     Example
     -------
-    create_dlv_roi(some_patient, some_case, some_exam, 'PTV^MD', 'zIDL_100%') -> ROI named 'zPTV^MD_DLV20'
+    create_dlv_roi(some_patient, some_case, some_used_colors, some_exam, 'PTV^MD', 'zIDL_100%') -> ROI named 'zPTV^MD_DLV20'
     """
     # Create unique DLV ROI name
     exp_sz_mm = str(int(exp_sz * 10)).zfill(2)  # Convert cm to mm for name to mimic TG-263 convention for PRVs
-    dlv_roi = create_roi(patient, case, f'z{target_name}_DLV{exp_sz_mm}', 'DoseRegion')
+    dlv_roi = create_roi(patient, case, used_colors, f'z{target_name}_DLV{exp_sz_mm}', 'DoseRegion')
     
     # DLV = intersection of target expansion, and IDL
     dlv_roi.SetAlgebraExpression(ExpressionA={'Operation': 'Union', 'SourceRoiNames': [target_name],
@@ -81,19 +151,13 @@ def create_dlv_roi(patient: PyScriptObject, case: PyScriptObject, exam: PyScript
                                                                  'Superior': exp_sz, 'Inferior': exp_sz,
                                                                  'Anterior': exp_sz, 'Posterior': exp_sz,
                                                                  'Right': exp_sz, 'Left': exp_sz}},
-                                 ExpressionB={'Operation': 'Union', 'SourceRoiNames': [idl_roi_name],
-                                              'MarginSettings': {'Type': 'Expand',
-                                                                 'Superior': 0, 'Inferior': 0,
-                                                                 'Anterior': 0, 'Posterior': 0,
-                                                                 'Right': 0, 'Left': 0}},
+                                 ExpressionB={'Operation': 'Union', 'SourceRoiNames': [idl_roi_name], 'MarginSettings': PlanQualConstants.NO_MARGIN},  # The IDL as is. RayStation requires margin settings for each expression
                                  ResultOperation='Intersection',
-                                 ResultMarginSettings={'Type': 'Expand',
-                                                       'Superior': 0, 'Inferior': 0,
-                                                       'Anterior': 0, 'Posterior': 0,
-                                                       'Right': 0, 'Left': 0})
+                                 ResultMarginSettings=PlanQualConstants.NO_MARGIN)
     
     # Create the geometry on the exam, according to the algebra expression
-    dlv_roi.UpdateDerivedGeometry(Examination=exam, Algorithm='Auto')
+    if exam is not None:
+        dlv_roi.UpdateDerivedGeometry(Examination=exam, Algorithm='Auto')
     
     return dlv_roi
 
@@ -101,59 +165,109 @@ def create_dlv_roi(patient: PyScriptObject, case: PyScriptObject, exam: PyScript
 def format_name(name: str) -> str:
     """Converts the patient's Name attribute into a better format for display
 
-    Arguments
-    ---------
-    pt: The patient whose name to format
+    Argument
+    --------
+    name: The patient Name attribute to format
 
     Returns
     -------
     The formatted patient name
 
-    Example
+    Examples
+    --------
+    format_name('^Jones^Bill^^M') -> 'Jones, Bill M'
+    format_name('Jones') -> 'Jones'
+    """
+    parts = [part for part in name.split('^') if part]  # Empty parts come from consecutive carets
+    if len(parts) <= 1:
+        return parts[0] if parts else ''
+    return f'{parts[0]}, {" ".join(parts[1:])}'
+
+
+def format_metric(value: Optional[float]) -> str:
+    """Formats a metric value to 3 decimal places for the report
+
+    Argument
+    --------
+    value: The metric value, or None if it could not be computed
+
+    Returns
+    -------
+    The formatted value, or 'N/A' if the value is None
+
+    Examples
+    --------
+    format_metric(0.87654) -> '0.877'
+    format_metric(None) -> 'N/A'
+    """
+    return 'N/A' if value is None else f'{value:.3f}'
+
+
+def roi_volume(geom: PyScriptObject) -> float:
+    """Computes the volume of an ROI geometry, which is zero if the geometry is empty
+
+    RayStation cannot compute the volume of an empty geometry, which can happen for a dose region that the dose never reaches
+
+    Argument
+    --------
+    geom: The ROI geometry whose volume to compute
+
+    Returns
     -------
-    Given some_pt with Name '^Jones^Bill^^M':
-    format_pt_name(some_pt) -> 'Jones, Bill M'
+    The volume, in cc
     """
-    parts = [part for part in re.split(r'\^+', name) if part != '']
-    name = parts[0]
-    if len(parts) > 0:
-        name += ', ' + ' '.join(parts[1:])
-    return name
+    return geom.GetRoiVolume() if geom.HasContours() else 0
 
 
-def unique_color(case: PyScriptObject) -> str:
-    """Generates a new (A, R, G, B) color unique among all ROI colors in the case and the TG-263 colors DataFrame
+def safe_ratio(num: float, denom: float) -> Optional[float]:
+    """Divides two numbers, unless the denominator is zero
+
+    Arguments
+    ---------
+    num: The numerator
+    denom: The denominator
+
+    Returns
+    -------
+    num / denom, or None if denom is zero
+
+    Examples
+    --------
+    safe_ratio(1, 4) -> 0.25
+    safe_ratio(1, 0) -> None
+    """
+    return num / denom if denom else None
+
+
+def unique_color(used_colors: Set[str]) -> str:
+    """Generates a new (A, R, G, B) color unique among the given used colors, and adds the new color to them
 
     Argument
     --------
-    The case whose ROI colors the new color must be unique among
+    used_colors: The colors, formatted as 'A, R, G, B', that the new color must be unique among (e.g., all ROI colors in the case and the TG-263 colors)
 
     Raises
     ------
-    ValueError: If there are 255^4 ROI and TG-263 colors, so that no unique color can be generated
+    ValueError: If there are 256^4 ROI and TG-263 colors, so that no unique color can be generated
 
     Returns
     -------
     The unique color, as a string 'A, R, G, B', where each component is between 0 and 255, inclusive
     """
-    # Get the colors used so far
-    used_colors = [f'{roi.Color.A}, {roi.Color.R}, {roi.Color.G}, {roi.Color.B}' for roi in case.PatientModel.RegionsOfInterest]  # Format System.Colors as 'A, R, G, B'
-    used_colors += list(PlanQualConstants.TG263_COLORS['Color'].values)
-    used_colors = list(set(used_colors))  # Remove duplicates
-
     # Ensure there are other colors in the color space
-    max_num_colors = 255 ** 4
-    if len(used_colors) == max_num_colors:
+    max_num_colors = 256 ** 4  # Each component is between 0 and 255, inclusive
+    if len(used_colors) >= max_num_colors:
         raise ValueError(f'There are only {max_num_colors} unique colors in the color space.')
 
-    # Generate 'A, R, G, B' colors until a color is not in the list of used colors
+    # Generate 'A, R, G, B' colors until a color is not in the set of used colors
     while True:
         color = f'{random.randint(0, 255)}, {random.randint(0, 255)}, {random.randint(0, 255)}, {random.randint(0, 255)}'
         if color not in used_colors:
+            used_colors.add(color)
             return color
 
 
-def create_roi(patient: PyScriptObject, case: PyScriptObject, roi_name: str, roi_type: Optional[str] = 'Undefined') -> PyScriptObject:
+def create_roi(patient: PyScriptObject, case: PyScriptObject, used_colors: Set[str], roi_name: str, roi_type: Optional[str] = 'Undefined') -> PyScriptObject:
     """Creates an ROI with the given name, made unique, and the given type
 
     Makes the ROI invisible
@@ -162,6 +276,7 @@ def create_roi(patient: PyScriptObject, case: PyScriptObject, roi_name: str, roi
     ---------
     patient: The patient in which to craete the ROI
     case: The case in which to create the ROI
+    used_colors: The colors already used in the case or by TG-263, for generating a unique color if the name is not in the TG-263 spreadsheet
     roi_name: The desired name for the ROI
     roi_type: The ROI type
               Defaults to 'Undefined'
@@ -174,10 +289,7 @@ def create_roi(patient: PyScriptObject, case: PyScriptObject, roi_name: str, roi
     
     # Use color from TG-263 spreadsheet if the name is in the spreadsheet
     # Otherwise, use random unique color
-    try:
-        color = PlanQualConstants.TG263_COLORS[roi_name]
-    except KeyError:
-        color = unique_color(case)
+    color = PlanQualConstants.TG263_COLORS.get(roi_name) or unique_color(used_colors)
 
     roi = case.PatientModel.CreateRoi(Name=unique_roi_name, Color=color, Type=roi_type)
     patient.SetRoiVisibility(RoiName=unique_roi_name, IsVisible=False)
@@ -199,6 +311,7 @@ def plan_quality_metrics() -> None:
     - Dmean for Brain
 
     Dmax, V12, and V4.5 can only be computed if the beam set fractionation is set
+    V12 and V4.5 are the volumes of the External that receive at least 12 Gy and 4.5 Gy, so they also require an External geometry
     CIs, HI, GI, and % coverage require an Rx
     Brain Dmean obviously requires a Brain geometry
     """
@@ -223,14 +336,16 @@ def plan_quality_metrics() -> None:
     if not os.path.isdir(PlanQualConstants.OUTPUT_DIR):
         os.makedirs(PlanQualConstants.OUTPUT_DIR)
     pt_name = format_name(patient.Name)
-    filename = pt_name + ' ' + plan.Name + ' ' + datetime.now().strftime('%Y-%m-%d %H_%M_%S') + '.pdf'
-    filepath = os.path.join(PlanQualConstants.OUTPUT_DIR, re.sub(r'[<>:"/\\\|\?\*]', '_', filename))
+    filename = f'{pt_name} {plan.Name} {datetime.now():%Y-%m-%d %H_%M_%S}.pdf'
+    filepath = os.path.join(PlanQualConstants.OUTPUT_DIR, PlanQualConstants.INVALID_FILENAME_CHARS_RE.sub('_', filename))
 
     pdf = SimpleDocTemplate(filepath, pagesize=landscape(letter), bottomMargin=0.2 * inch, leftMargin=0.25 * inch, rightMargin=0.2 * inch, topMargin=0.2 * inch)  # 8.5 x 11", 0.2" top and bottom margin, 0.25" left and right margin
-    hdg_2 = Paragraph(pt_name + ': MRN ' + patient.PatientID, style=PlanQualConstants.STYLES['Heading2'])
-    hdg_1 = Paragraph('Plan Quality Metrics for: ' + plan.Name, style=PlanQualConstants.STYLES['Heading1'])
+    styles = PlanQualConstants.STYLES
+    hdg_2 = Paragraph(f'{pt_name}: MRN {patient.PatientID}', style=styles['Heading2'])
+    hdg_1 = Paragraph(f'Plan Quality Metrics for: {plan.Name}', style=styles['Heading1'])
 
-    metrics_data = [[Paragraph(txt, style=PlanQualConstants.STYLES['Heading3']) for txt in ['Beam set', 'Target', 'D<sub>0.035 cc</sub> [cGy]', 'Paddick CI', 'RTOG CI', 'CTV HI', 'GI', 'Coverage', 'V<sub>12 Gy</sub> [cc]', 'V<sub>4.5 Gy</sub> [cc]', 'Brain D<sub>mean</sub> [cGy]']]]
+    hdg3_style = styles['Heading3']  # Bound once for all header cells
+    metrics_data = [[Paragraph(txt, style=hdg3_style) for txt in ['Beam set', 'Target', 'D<sub>0.035 cc</sub> [cGy]', 'Paddick CI', 'RTOG CI', 'CTV HI', 'GI', 'Coverage', 'V<sub>12 Gy</sub> [cc]', 'V<sub>4.5 Gy</sub> [cc]', 'Brain D<sub>mean</sub> [cGy]']]]
     metrics_style = [  # Center-align, middle-align, and black outline for all cells. Gray background for header row
         ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
         ('BACKGROUND', (0, 0), (-1, 0), dimgray),
@@ -239,26 +354,47 @@ def plan_quality_metrics() -> None:
         ('VALIGN', (0, 0), (-1, -1), 'MIDDLE')
     ]
 
-    # RoIs that are not target specific
-    twelve_gy_roi = create_roi(patient, case, 'zIDL_1200', 'DoseRegion')
-    fourp5_gy_roi = create_roi(patient, case, 'zIDL_450', 'DoseRegion')
-
-    target_names = [roi.Name for roi in case.PatientModel.RegionsOfInterest if roi.OrganData.OrganType == 'Target']
+    # Colors used so far (so that new ROIs get unique colors), target names, External name, and whether there is a Brain ROI, from a single pass over the case's ROIs
+    used_colors = set(PlanQualConstants.TG263_COLORS.values())
+    target_names = []
+    ext_name = None
+    has_brain = False
+    patient_model = case.PatientModel
+    for roi in patient_model.RegionsOfInterest:
+        roi_name = roi.Name
+        color = roi.Color
+        used_colors.add(f'{color.A}, {color.R}, {color.G}, {color.B}')  # Format System.Colors as 'A, R, G, B'
+        if roi.OrganData.OrganType == 'Target':
+            target_names.append(roi_name)
+        elif roi.Type == 'External':  # There will never be more than one external ROI
+            ext_name = roi_name
+        if roi_name == 'Brain':
+            has_brain = True
 
     tbl_row = 1  # Current row in the table (row 0 is the column headers)
 
+    # Exam name : names of targets with geometries on that exam
+    # Beam sets on the same exam share a structure set, so each exam's geometries only need to be checked once
+    target_names_by_exam = {}
+
     for beam_set in plan.BeamSets:
-        beam_set.FractionDose.UpdateDoseGridStructures()  # Just in case brain geometry needs updating. Otherwise all stats for beain (incl. Dmean, which we use, will be zero)
+        # Beam set attributes used for every target, read once
+        beam_set_name = beam_set.DicomPlanLabel
+        beam_set_name_cell = Paragraph(escape(beam_set_name), style=PlanQualConstants.TBL_NAME_STYLE)  # Only ever used in one row of the table
+        fx_dose = beam_set.FractionDose
+        fx_dose.UpdateDoseGridStructures()  # Before any dose statistic, in case any ROI geometry (e.g., Brain, a target) was edited after the dose was computed. Otherwise stats for that ROI are stale or zero
+        struct_set = beam_set.GetStructureSet()
+
         # ROI geometries on beam set exam
-        roi_geoms = beam_set.GetStructureSet().RoiGeometries
-        target_names_beam_set = [target_name for target_name in target_names if roi_geoms[target_name].HasContours()]
+        roi_geoms = struct_set.RoiGeometries
 
         # Beam set planning exam
-        exam = beam_set.GetStructureSet().OnExamination
+        exam = struct_set.OnExamination
         exam_name = exam.Name
-        
-        # Data to add as row in the ReportLab table
-        beam_set_data = [beam_set.DicomPlanLabel]
+
+        if exam_name not in target_names_by_exam:
+            target_names_by_exam[exam_name] = [target_name for target_name in target_names if roi_geoms[target_name].HasContours()]
+        target_names_beam_set = target_names_by_exam[exam_name]
 
         rx = beam_set.Prescription.PrimaryPrescriptionDoseReference
         if rx is not None:
@@ -266,38 +402,34 @@ def plan_quality_metrics() -> None:
         fractions = beam_set.FractionationPattern
         if fractions is not None:
             fractions = fractions.NumberOfFractions
+        rx_per_fx = rx / fractions if rx is not None and fractions is not None else None  # Rx in the units of FractionDose values; used for every target
 
         # Brain Dmean
         # 'N/A' if no Brain ROI or Brain geometry empty on beam set planning exam
-        try:
-            brain_geom = roi_geoms['Brain']
-        except:  # No Brain ROI
-            brain_d_mean = 'N/A'
+        if has_brain and roi_geoms['Brain'].HasContours():
+            brain_d_mean = fx_dose.GetDoseStatistic(RoiName='Brain', DoseType='Average')
+            brain_d_mean_str = f'{brain_d_mean:.3f}'
         else:
-            if brain_geom.HasContours():
-                brain_d_mean = beam_set.FractionDose.GetDoseStatistic(RoiName='Brain', DoseType='Average')
-            else:  # Brain geometry is empty on planning exam
-                brain_d_mean = 'N/A'
-        if brain_d_mean != 'N/A':
-            brain_d_mean = f'{brain_d_mean:.3f}'
+            brain_d_mean_str = 'N/A'
 
         # Can only do Brain Dmean if there is no Rx
         # All other stats depend on Rx
         if fractions is None:
             metrics_style.append(('SPAN', (1, tbl_row), (-2, tbl_row)))
-            metrics_data.append([Paragraph(txt, style=PlanQualConstants.STYLES['Normal']) for txt in [beam_set.DicomPlanLabel, 'No fractionation for beam set'] + [''] * 8 + [brain_d_mean]])
+            metrics_data.append([beam_set_name_cell, 'No fractionation for beam set'] + [''] * 8 + [brain_d_mean_str])
             
             tbl_row += 1
         else:
-            # Total volume (not volume of an ROI) at 12 Gy and 4.5 Gy, respectively
-
-            twelve_gy_roi.CreateRoiGeometryFromDose(DoseDistribution=beam_set.FractionDose, ThresholdLevel=1200 / fractions)
-            twelve_gy_roi_vol = roi_geoms[twelve_gy_roi.Name].GetRoiVolume()
-            twelve_gy_roi_vol = f'{twelve_gy_roi_vol:.3f}'
-
-            fourp5_gy_roi.CreateRoiGeometryFromDose(DoseDistribution=beam_set.FractionDose, ThresholdLevel=450 / fractions)
-            fourp5_gy_roi_vol = roi_geoms[fourp5_gy_roi.Name].GetRoiVolume()
-            fourp5_gy_roi_vol = f'{fourp5_gy_roi_vol:.3f}'
+            # Volume of the External at 12 Gy and 4.5 Gy, respectively, from a single DVH query instead of isodose ROIs
+            # The External is often edited after the dose is computed, so this query relies on the UpdateDoseGridStructures call above
+            # 'N/A' if no External geometry on beam set planning exam, or no External dose statistics even after the update
+            if ext_name is not None and roi_geoms[ext_name].HasContours() and fx_dose.GetDoseGridRoi(RoiName=ext_name).RoiVolumeDistribution is not None:
+                ext_vol = roi_geoms[ext_name].GetRoiVolume()
+                twelve_gy_rel_vol, fourp5_gy_rel_vol = fx_dose.GetRelativeVolumeAtDoseValues(RoiName=ext_name, DoseValues=[1200 / fractions, 450 / fractions])
+                twelve_gy_roi_vol, fourp5_gy_roi_vol = twelve_gy_rel_vol * ext_vol, fourp5_gy_rel_vol * ext_vol
+                twelve_gy_roi_vol_str, fourp5_gy_roi_vol_str = f'{twelve_gy_roi_vol:.3f}', f'{fourp5_gy_roi_vol:.3f}'
+            else:
+                twelve_gy_roi_vol_str = fourp5_gy_roi_vol_str = 'N/A'
 
             # Can only do Brain Dmean, V12, and V4.5 if no target geometries
             # All other stats depend on target volume
@@ -306,97 +438,102 @@ def plan_quality_metrics() -> None:
                 if len(target_names_beam_set) > 1:
                     metrics_style.extend([('SPAN', (i, tbl_row), (i, tbl_row + len(target_names_beam_set) - 1)) for i in [0, -3, -2, -1]])  # Span rows: beam set, V12, V4.5, and brain Dmean columns
 
-                # Compute target volume-dependent stats for each target geometry on the beam set's exam
-                for i, target_name in enumerate(target_names_beam_set):
-                    abs_target_vol = roi_geoms[target_name].GetRoiVolume()  # Total target volume
-
-                    # Dmax
-                    d_max = beam_set.FractionDose.GetDoseAtRelativeVolumes(RoiName=target_name, RelativeVolumes=[0.035 / abs_target_vol])[0]
-                    d_max *= fractions
-                    d_max = f'{d_max:.2f}'
-
-                    if rx is None:
-                        metrics_style.append(('SPAN', (3, tbl_row), (-4, tbl_row)))
-                        metrics_data.append([Paragraph(txt, style=PlanQualConstants.STYLES['Normal']) for txt in [beam_set.DicomPlanLabel, target_name, d_max, 'No Rx for beam set'] + [''] * 4 + [twelve_gy_roi_vol, fourp5_gy_roi_vol, brain_d_mean]])
-                    else:
-                        # Set geometries and get necessary volumes and other stats
-                        idl_100_pct_roi = create_roi(patient, case, 'zIDL_100%', 'DoseRegion')
-                        idl_100_pct_roi.CreateRoiGeometryFromDose(DoseDistribution=beam_set.FractionDose, ThresholdLevel=rx / fractions)
-                        idl_100_pct_roi_vol = roi_geoms[idl_100_pct_roi.Name].GetRoiVolume()
-
-                        idl_50_pct_roi = create_roi(patient, case, 'zIDL_50%', 'DoseRegion')
-                        idl_50_pct_roi.CreateRoiGeometryFromDose(DoseDistribution=beam_set.FractionDose, ThresholdLevel=rx * 0.5 / fractions)
-                        idl_50_pct_roi_vol = roi_geoms[idl_50_pct_roi.Name].GetRoiVolume()
-
-                        dlv_roi = create_dlv_roi(patient, case, exam, target_name, idl_100_pct_roi.Name, 2.2)  # A bit larger than 2 cm
-                        dlv_roi_vol = roi_geoms[dlv_roi.Name].GetRoiVolume()
-
-                        idl_100_pct_and_target_roi = create_roi(patient, case, f'z{idl_100_pct_roi.Name}&{target_name}')
-                        idl_100_pct_and_target_roi.SetAlgebraExpression(ExpressionA={'Operation': 'Union', 'SourceRoiNames': [idl_100_pct_roi.Name], 'MarginSettings': { 'Type': 'Expand', 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 } }, ExpressionB={ 'Operation': 'Union', 'SourceRoiNames': [target_name], 'MarginSettings': { 'Type': 'Expand', 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 } }, ResultOperation='Intersection', ResultMarginSettings={ 'Type': 'Expand', 'Superior': 0, 'Inferior': 0, 'Anterior': 0, 'Posterior': 0, 'Right': 0, 'Left': 0 })
-                        idl_100_pct_and_target_roi.UpdateDerivedGeometry(Examination=exam, Algorithm='Auto')
-                        
-                        idl_100_pct_and_target_geom = roi_geoms[idl_100_pct_and_target_roi.Name]
-                        if idl_100_pct_and_target_geom.HasContours():
-                            idl_100_pct_and_target_roi_vol = idl_100_pct_and_target_geom.GetRoiVolume()
+                # IDL ROIs depend only on the Rx, so they are shared by all targets in the beam set
+                idl_rois = []  # Rx-dependent IDL ROIs to delete after all targets
+
+                # Delete the IDL ROIs even if a computation fails, so that they don't accumulate in the case
+                try:
+                    if rx is not None:
+                        idl_100_pct_roi = create_roi(patient, case, used_colors, 'zIDL_100%', 'DoseRegion')
+                        idl_rois.append(idl_100_pct_roi)
+                        idl_100_pct_roi_name = idl_100_pct_roi.Name
+                        idl_100_pct_roi.CreateRoiGeometryFromDose(DoseDistribution=fx_dose, ThresholdLevel=rx_per_fx)
+                        idl_100_pct_roi_vol = roi_volume(roi_geoms[idl_100_pct_roi_name])
+
+                        idl_50_pct_roi = create_roi(patient, case, used_colors, 'zIDL_50%', 'DoseRegion')
+                        idl_rois.append(idl_50_pct_roi)
+                        idl_50_pct_roi.CreateRoiGeometryFromDose(DoseDistribution=fx_dose, ThresholdLevel=0.5 * rx_per_fx)
+                        idl_50_pct_roi_vol = roi_volume(roi_geoms[idl_50_pct_roi.Name])
+
+                    # Compute target volume-dependent stats for each target geometry on the beam set's exam
+                    for i, target_name in enumerate(target_names_beam_set):
+                        # Beam set name and non-target-specific stats go in the first target row only, since those cells span all target rows
+                        if i == 0:
+                            beam_set_cell, non_target_cells = beam_set_name_cell, [twelve_gy_roi_vol_str, fourp5_gy_roi_vol_str, brain_d_mean_str]
                         else:
-                            idl_100_pct_and_target_roi_vol = 0
-
-                        # Paddick CI
-                        paddick_ci = (idl_100_pct_and_target_roi_vol * idl_100_pct_and_target_roi_vol) / (dlv_roi_vol * abs_target_vol)
-                        paddick_ci = f'{paddick_ci:.3f}'
-
-                        # RTOG CI
-                        rtog_ci = dlv_roi_vol / abs_target_vol
-                        rtog_ci = f'{rtog_ci:.3f}'
-
-                        # CTV HI
-                        d_5_pct_vol, d_95_pct_vol = beam_set.FractionDose.GetDoseAtRelativeVolumes(RoiName=target_name, RelativeVolumes=[0.05, 0.95])
-                        ctv_hi = (d_5_pct_vol - d_95_pct_vol) / rx
-                        ctv_hi = f'{ctv_hi:.3f}'
+                            beam_set_cell, non_target_cells = '', [''] * 3
 
-                        # GI
-                        gi = idl_50_pct_roi_vol / idl_100_pct_roi_vol
-                        gi = f'{gi:.3f}'
+                        target_cell = Paragraph(escape(target_name), style=PlanQualConstants.TBL_NAME_STYLE)
+                        abs_target_vol = roi_geoms[target_name].GetRoiVolume()  # Total target volume
 
-                        # Coverage
-                        coverage = beam_set.FractionDose.GetRelativeVolumeAtDoseValues(RoiName=target_name, DoseValues=[rx / fractions])[0]
-                        coverage *= 100
-                        coverage = f'{coverage:.2f}% at {rx:.0f} cGy'
+                        # Dmax
+                        # D0.035, D5%, and D95% (fraction doses) in a single dose query. D5% and D95% are used for CTV HI below
+                        d_max, d_5_pct_vol, d_95_pct_vol = fx_dose.GetDoseAtRelativeVolumes(RoiName=target_name, RelativeVolumes=[0.035 / abs_target_vol, 0.05, 0.95])
+                        d_max *= fractions
+                        d_max_str = f'{d_max:.2f}'
 
-                        # Delete unnecessary target volume-dependent ROIs
-                        for roi in [idl_100_pct_roi, idl_50_pct_roi, dlv_roi, idl_100_pct_and_target_roi]:
-                            roi.DeleteRoi()
-
-                        # Add stats to table row data for this beam set
-                        beam_set_data = [beam_set.DicomPlanLabel if i == 0 else '', target_name, paddick_ci, rtog_ci, ctv_hi, gi, d_max, coverage]
-                        if i == 0:
-                            beam_set_data.extend([twelve_gy_roi_vol, fourp5_gy_roi_vol, brain_d_mean]) 
+                        if rx is None:
+                            metrics_style.append(('SPAN', (3, tbl_row), (-4, tbl_row)))
+                            metrics_data.append([beam_set_cell, target_cell, d_max_str, 'No Rx for beam set'] + [''] * 4 + non_target_cells)
                         else:
-                            beam_set_data.extend([''] * 3)
-                        metrics_data.append([Paragraph(txt, style=PlanQualConstants.STYLES['Normal']) for txt in beam_set_data])
-
-                    tbl_row += 1
+                            # Set geometries and get necessary volumes and other stats
+                            temp_rois = []  # Target volume-dependent ROIs to delete
+
+                            # Delete the temporary ROIs even if a computation fails, so that they don't accumulate in the case
+                            try:
+                                idl_100_pct_and_target_roi = create_roi(patient, case, used_colors, f'z{idl_100_pct_roi_name}&{target_name}')
+                                temp_rois.append(idl_100_pct_and_target_roi)
+                                idl_100_pct_and_target_roi_name = idl_100_pct_and_target_roi.Name
+                                idl_100_pct_and_target_roi.SetAlgebraExpression(ExpressionA={'Operation': 'Union', 'SourceRoiNames': [idl_100_pct_roi_name], 'MarginSettings': PlanQualConstants.NO_MARGIN}, ExpressionB={'Operation': 'Union', 'SourceRoiNames': [target_name], 'MarginSettings': PlanQualConstants.NO_MARGIN}, ResultOperation='Intersection', ResultMarginSettings=PlanQualConstants.NO_MARGIN)
+
+                                dlv_roi = create_dlv_roi(patient, case, used_colors, None, target_name, idl_100_pct_roi_name, 2.2)  # A bit larger than 2 cm. Geometry is updated below, with the other derived ROI
+                                temp_rois.append(dlv_roi)
+                                dlv_roi_name = dlv_roi.Name
+
+                                # Update both derived geometries in a single call
+                                patient_model.UpdateDerivedGeometries(RoiNames=[dlv_roi_name, idl_100_pct_and_target_roi_name], Examination=exam, Algorithm='Auto')
+                                dlv_roi_vol = roi_volume(roi_geoms[dlv_roi_name])
+
+                                idl_100_pct_and_target_roi_vol = roi_volume(roi_geoms[idl_100_pct_and_target_roi_name])
+
+                                # Coverage
+                                coverage = fx_dose.GetRelativeVolumeAtDoseValues(RoiName=target_name, DoseValues=[rx_per_fx])[0]  # Fraction of target volume; formatted as a percentage below
+                            finally:
+                                # Delete unnecessary target volume-dependent ROIs
+                                for roi in temp_rois:
+                                    roi.DeleteRoi()
+
+                            # Ratios are None (displayed as 'N/A') if the denominator is zero (e.g., the dose never reaches the Rx)
+                            paddick_ci = safe_ratio(idl_100_pct_and_target_roi_vol * idl_100_pct_and_target_roi_vol, dlv_roi_vol * abs_target_vol)  # Paddick CI
+                            rtog_ci = safe_ratio(dlv_roi_vol, abs_target_vol)  # RTOG CI
+                            ctv_hi = safe_ratio(d_5_pct_vol - d_95_pct_vol, rx_per_fx)  # CTV HI
+                            gi = safe_ratio(idl_50_pct_roi_vol, idl_100_pct_roi_vol)  # GI
+
+                            # Add stats to table row data for this beam set
+                            metrics_data.append([beam_set_cell, target_cell, d_max_str, format_metric(paddick_ci), format_metric(rtog_ci), format_metric(ctv_hi), format_metric(gi), f'{coverage:.2%} at {rx:.0f} cGy'] + non_target_cells)
+
+                        tbl_row += 1
+                finally:
+                    # Delete unnecessary Rx-dependent IDL ROIs
+                    for roi in idl_rois:
+                        roi.DeleteRoi()
 
             else:  # No target geometries on beam set exam
                 # Display 'No target geometries' message across all target volume-dependent columns in the beam set's row
                 metrics_style.append(('SPAN', (1, tbl_row), (-4, tbl_row)))
                 msg = 'No target geometries on exam' if target_names else 'No target ROIs in case'
-                metrics_data.append([Paragraph(txt, style=PlanQualConstants.STYLES['Normal']) for txt in [beam_set.DicomPlanLabel, msg] + [''] * 6 + [twelve_gy_roi_vol, fourp5_gy_roi_vol, brain_d_mean]])
+                metrics_data.append([beam_set_name_cell, msg] + [''] * 6 + [twelve_gy_roi_vol_str, fourp5_gy_roi_vol_str, brain_d_mean_str])
                 
                 tbl_row += 1
 
-    # Delete unnecessary Rx-dependent ROIs
-    for roi in [twelve_gy_roi, fourp5_gy_roi]:
-        roi.DeleteRoi()
-
-    tbl = Table(metrics_data, style=TableStyle(metrics_style))
+    tbl = LongTable(metrics_data, colWidths=PlanQualConstants.TBL_COL_WIDTHS, repeatRows=1, splitByRow=1, style=TableStyle(metrics_style))  # LongTable lays out long tables faster, and repeats the header row on each page
     elems = [KeepTogether([hdg_2, hdg_1]), tbl]
     pdf.build(elems)
 
-    # Open report
+    # Open report in the first Adobe Reader that is installed, or in the default PDF viewer if none is
     for reader_path in PlanQualConstants.ADOBE_READER_PATHS:
-        try:
-            os.system(f'START /B "{reader_path}" "{filepath}"')
+        if os.path.isfile(reader_path):
+            subprocess.Popen([reader_path, filepath], creationflags=subprocess.DETACHED_PROCESS)  # Don't wait on, or spawn a shell for, the reader
             break
-        except:
-            continue
+    else:
+        os.startfile(filepath)
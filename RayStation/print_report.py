@@ -1,14 +1,16 @@
 import clr
+from datetime import datetime
 import os
 import re
+import subprocess
 import sys
 
 from connect import *  # Interact with RayStation
 
-from PyPDF2 import PdfFileMerger, PdfFileReader
+from PyPDF2 import PdfFileMerger
 
 clr.AddReference('System.Windows.Forms')
-from System.Windows.Forms import MessageBox  # To display errors
+from System.Windows.Forms import DialogResult, MessageBox, MessageBoxButtons  # To display errors
 
 sys.path.append(os.path.join('T:', os.sep, 'Physics', 'KW', 'med-phys-scripts', 'RayStation'))
 from sbrt_lung_analysis import sbrt_lung_analysis
@@ -31,28 +33,31 @@ class PrintRptConstants(object):
     # Paths to Adobe Reader on RS servers
     ADOBE_READER_PATHS = [os.path.join('C:', os.sep, 'Program Files (x86)', 'Adobe', 'Reader 11.0', 'Reader', 'AcroRd32.exe'), os.path.join('C:', os.sep, 'Program Files (x86)', 'Adobe', 'Acrobat Reader DC', 'Reader', 'AcroRd32.exe')]
 
+    # Filename translation table and compiled regular expression
+    INVALID_FILENAME_CHARS_TRANS = str.maketrans(dict.fromkeys('<>:"/\\|?*', '_'))  # Replaces each character not allowed in Windows filenames with an underscore
+    LUNG_RE = re.compile(r'(^|[^A-Z])lung($|[^A-Z])', re.IGNORECASE)  # "lung" as a word, in a case, plan, or beam set attribute
+
 
 def format_name(name: str) -> str:
     """Converts the patient's Name attribute into a better format for display
 
-    Arguments
-    ---------
-    pt: The patient whose name to format
+    Argument
+    --------
+    name: The patient Name attribute to format
 
     Returns
     -------
     The formatted patient name
 
-    Example
-    -------
-    Given some_pt with Name '^Jones^Bill^^M':
-    format_pt_name(some_pt) -> 'Jones, Bill M'
+    Examples
+    --------
+    format_name('^Jones^Bill^^M') -> 'Jones, Bill M'
+    format_name('Jones') -> 'Jones'
     """
-    parts = [part for part in re.split(r'\^+', name) if part != '']
-    name = parts[0]
-    if len(parts) > 0:
-        name += ', ' + ' '.join(parts[1:])
-    return name
+    parts = [part for part in name.split('^') if part]  # Empty parts come from consecutive carets
+    if len(parts) <= 1:
+        return parts[0] if parts else ''
+    return f'{parts[0]}, {" ".join(parts[1:])}'
 
 
 def print_report() -> None:
@@ -69,7 +74,7 @@ def print_report() -> None:
         MessageBox.Show('There is no case open. Click OK to abort the script.', 'No Open Case')
         sys.exit()
     try:
-        patient = get_current('Plan')
+        plan = get_current('Plan')
     except:
         MessageBox.Show('There is no plan open. Click OK to abort the script.', 'No Open Plan')
         sys.exit()
@@ -86,7 +91,8 @@ def print_report() -> None:
         sys.exit()
 
     # Exit with an error if dose statistics need updating
-    if any(geom.HasContours() and plan.TreatmentCourse.TotalDose.GetDoseGridRoi(RoiName=geom.OfRoi.Name).RoiVolumeDistribution is None for geom in plan.GetTotalDoseStructureSet().RoiGeometries):
+    total_dose = plan.TreatmentCourse.TotalDose
+    if any(geom.HasContours() and total_dose.GetDoseGridRoi(RoiName=geom.OfRoi.Name).RoiVolumeDistribution is None for geom in plan.GetTotalDoseStructureSet().RoiGeometries):
         MessageBox.Show('Dose statistics missing. Click OK to abort the script.', 'Missing Dose Statistics')
         sys.exit()
 
@@ -95,19 +101,18 @@ def print_report() -> None:
         template = next(t for t in clinic_db.GetSiteSettings().ReportTemplates if t.Name == PrintRptConstants.PRINT_REPORT_TEMPLATE_NAME)
     except StopIteration:
         # Display message if report template does not exist
-        MessageBox.Show('The report template "' + PRINT_REPORT_TEMPLATE_NAME + '" does not exist. Click OK to abort the script.', 'Template Does Not Exist')
+        MessageBox.Show('The report template "' + PrintRptConstants.PRINT_REPORT_TEMPLATE_NAME + '" does not exist. Click OK to abort the script.', 'Template Does Not Exist')
         sys.exit()
 
-    patient.Save()  # Must save patient before report creation
-
     # Report filepath
     if not os.path.isdir(PrintRptConstants.PRINT_REPORT_OUTPUT_DIR):
         os.makedirs(PrintRptConstants.PRINT_REPORT_OUTPUT_DIR)
     pt_name = format_name(patient.Name)
     filename = pt_name + ' ' + beam_set.BeamSetIdentifier() + ' ' + datetime.now().strftime('%Y-%m-%d %H_%M_%S') + '.pdf'
-    filepath = os.path.join(PrintRptConstants.PRINT_REPORT_OUTPUT_DIR, re.sub(r'[<>:"/\\\|\?\*]', '_', filename))
+    filepath = os.path.join(PrintRptConstants.PRINT_REPORT_OUTPUT_DIR, filename.translate(PrintRptConstants.INVALID_FILENAME_CHARS_TRANS))
     
     # Report
+    patient.Save()  # Must save patient before report creation. Saved only now, after all checks that could abort the script
     try:
         beam_set.CreateReport(templateName=PrintRptConstants.PRINT_REPORT_TEMPLATE_NAME, filename=filepath, ignoreWarnings=False)
     except Exception as e:
@@ -124,19 +129,22 @@ def print_report() -> None:
             num_fx = beam_set.FractionationPattern.NumberOfFractions
             if num_fx == 5 and rx / num_fx >= 600 and case.BodySite in ['Thorax', '']:
                 chk_for_body_site = [case.BodySite, case.CaseName, case.Comments, case.Diagnosis, plan.Comments, plan.Name] + [beam_set.DicomPlanLabel for beam_set in plan.BeamSets]
-                if any(re.search(r'(^|[^A-Z])lung($|[^A-Z])', name, re.IGNORECASE) is not None for name in chk_for_body_site):
+                if any(PrintRptConstants.LUNG_RE.search(name) is not None for name in chk_for_body_site):
                     sbrt_filepath = sbrt_lung_analysis()
                     # Merge beam set report and SBRT report
+                    # Write to a temporary file, not to the beam set report that is being read from, then replace the beam set report
+                    merged_filepath = filepath + '.tmp'
                     merger = PdfFileMerger()
-                    merger.append(PdfFileReader(open(filepath, 'rb')))
-                    merger.append(PdfFileReader(open(sbrt_filepath, 'rb')))
-                    merger.write(filepath)
-                    merger.close()
+                    merger.append(filepath)
+                    merger.append(sbrt_filepath)
+                    merger.write(merged_filepath)
+                    merger.close()  # Also closes the input files, which must be closed before the beam set report can be replaced
+                    os.replace(merged_filepath, filepath)
 
-    # Open report
+    # Open report in the first Adobe Reader that is installed, or in the default PDF viewer if none is
     for reader_path in PrintRptConstants.ADOBE_READER_PATHS:
-        try:
-            os.system(fr'START /B "{reader_path}" "{filepath}"')
+        if os.path.isfile(reader_path):
+            subprocess.Popen([reader_path, filepath], creationflags=subprocess.DETACHED_PROCESS)  # Don't wait on, or spawn a shell for, the reader
             break
-        except:
-            continue
+    else:
+        os.startfile(filepath)
@@ -1,7 +1,7 @@
 import clr
 import re
 import sys
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from connect import *  # Interact with RayStation
 from connect.connect_cpython import PyScriptObject  # For type hints
@@ -16,6 +16,29 @@ from System.Windows.Forms import *
 
 QACT_EXAM_DATE_REGEX = r'(\d{1,2}[/\-\. ]\d{1,2}[/\-\. ](\d{2}|\d{4}))|(\d{6}|\d{8})'
 
+_text_widths: Dict[Tuple[str, Font], int] = {}  # Cache of measured text widths, so that each string is only measured once per font
+
+
+def text_width(txt: str, font: Font) -> int:
+    """Computes the width of the text when drawn in the font
+
+    Ampersands are treated as literal characters, as in a Label with UseMnemonic = False
+    Widths are cached, since each measurement is a GDI call
+
+    Arguments
+    ---------
+    txt: The text to measure
+    font: The font in which the text is drawn
+
+    Returns
+    -------
+    The text width, in pixels
+    """
+    key = (txt, font)
+    if key not in _text_widths:
+        _text_widths[key] = TextRenderer.MeasureText(txt, font, Size.Empty, TextFormatFlags.NoPrefix).Width
+    return _text_widths[key]
+
 
 def add_date_to_exam_name(exam) -> None:
     """Adds a date to the end of an exam name, if a date does not exist
@@ -60,7 +83,7 @@ class QACTAdaptiveAnalysisForm(Form):
         # Adapt form size to contents
         self.AutoSize = True
         self.AutoSizeMode = AutoSizeMode.GrowAndShrink  # Adapt form size to controls
-        self.MinimumSize = Size(TextRenderer.MeasureText(self.Text, SystemFonts.CaptionFont).Width + 100, 0)
+        self.MinimumSize = Size(text_width(self.Text, SystemFonts.CaptionFont) + 100, 0)
         
         self.FormBorderStyle = FormBorderStyle.FixedToolWindow  # User cannot resize form
         self.StartPosition = FormStartPosition.CenterScreen  # Start form in middle of screen
@@ -106,12 +129,14 @@ class QACTAdaptiveAnalysisForm(Form):
             self.qact_combo.Items.AddRange(qacts)
             self.qact_combo.Location = Point(15 + qact_lbl.Width, y)
             self.qact_combo.SelectedIndex = 0
-            self.qact_combo.Width = max(TextRenderer.MeasureText(qact, self.qact_combo.Font).Width for qact in qacts) + 25
+            self.qact_combo.Width = max(text_width(qact, self.qact_combo.Font) for qact in qacts) + 25
             self.Controls.Add(self.qact_combo)
         y += tpct_lbl.Height + 15
 
         #geom_names = [geom.OfRoi.Name for geom in ss.RoiGeometries if geom.HasContours()]
-        lbl_width = self._get_lbl_width([geom.OfRoi.Name for geom in tpct_geoms]) * 2  # Double the necessary width for better formatting
+        # The geometry column must fit the bold "Geometry" header as well as the ROI names, and is never narrower than a default (100 px) Label
+        geom_hdr_width = text_width('Geometry', Font(Control.DefaultFont, FontStyle.Bold))
+        lbl_width = max(100, geom_hdr_width, self._get_lbl_width([geom.OfRoi.Name for geom in tpct_geoms])) * 2  # Double the necessary width for better formatting
         
         # "Geometry" label
         geom_lbl = Label()
@@ -214,7 +239,7 @@ class QACTAdaptiveAnalysisForm(Form):
         y += 15
 
         # Form is at least as wide as title text plus room for 'X' button, etc.
-        min_width = TextRenderer.MeasureText(self.Text, SystemFonts.CaptionFont).Width + 150
+        min_width = text_width(self.Text, SystemFonts.CaptionFont) + 150
         self.MinimumSize = Size(min_width, self.Height)
 
         # 'Start' button
@@ -229,20 +254,16 @@ class QACTAdaptiveAnalysisForm(Form):
         self.Controls.Add(self._start_btn)
         self.AcceptButton = self._start_btn
     
-    def _get_lbl_width(self, lbl_txt: List[str]) -> str:
+    def _get_lbl_width(self, lbl_txt: List[str]) -> int:
         """Computes the largest Label width necessary for any of the strings in list
 
+        Measures the text in the default Label font, instead of creating a Label for each string
+
         Argument
         --------
         lbl_txt: List of strings that will be displayed in a Label
         """
-        lbl_width = 0
-        for txt in lbl_txt:
-            l = Label()
-            l.Text = txt
-            l.UseMnemonic = False  # Treat ampersand as a literal characater
-            lbl_width = max(lbl_width, l.Width)
-        return lbl_width
+        return max((text_width(txt, Control.DefaultFont) for txt in lbl_txt), default=0)
     
     def _MouseClick(self, sender: Form, event: EventArgs) -> None:
         """Handles the event of clicking the Form